@@ -4,6 +4,9 @@ from .tiktok_research_enums import VideoSmallFields
 from .tiktok_research_enums import VideoFields
 from .tiktok_research_enums import CommentFields
 from .tiktok_research_enums import RegionCodes
+from .tiktok_research_limiter import RateLimiter
+from .tiktok_research_limiter import QuotaExceeded
+from .tiktok_research_cache import TTLCache
 from .tiktok_research import TikTokResearch
 from .tiktok_research_db import TikTokResearchDb
 from .peewee_db_model import db
@@ -18,4 +21,20 @@ from .peewee_db_model import Comment
 from .peewee_db_model import UserOnUser
 from .peewee_db_model import UserOnVideo
 from .peewee_db_model import Playlist
-from .peewee_db_model import VideoOnPlaylist
\ No newline at end of file
+from .peewee_db_model import VideoOnPlaylist
+from .peewee_db_model import ScrapeCheckpoint
+from .tiktok_research_queries import TikTokResearchQueries
+from .tiktok_research_export import DbExporter
+from .tiktok_research_records import VideoRecord
+from .peewee_db_model import CrawlFrontier
+from .tiktok_research_metrics import Metrics
+from .tiktok_research_metrics import LoggingSink
+from .tiktok_research_metrics import CallbackSink
+from .tiktok_research_metrics import PrometheusExporter
+from .tiktok_research_credentials import Credential
+from .tiktok_research_credentials import CredentialPool
+from .tiktok_research_transport import RequestsTransport
+from .tiktok_research_runner import ScrapeRunner
+from .tiktok_research_merge import DbMerger
+from .tiktok_research_merge import merge_databases
+from .tiktok_research_search import TikTokResearchSearch
@@ -18,6 +18,7 @@ class User(BaseModel):
     avatar_url = TextField(null=True) #This is the URL of the user's profile picture.
     avatar_path = TextField(null=True)
     is_verified = BooleanField(null=True) #This returns the information on whether the user has been verified. All verified users will have "blue tick" next to their username. If the user has a blue tick, this variable will return a "true" in the response.
+    updated_at = DateTimeField(null=True) #When the user info was last fetched from the API.
 
 class Region(BaseModel):
     name=CharField(unique=True, max_length=2) #A two digit code for the country where the video creator registered their account.
@@ -25,11 +26,12 @@ class Region(BaseModel):
 
 class Video(BaseModel):
     item_id = BigIntegerField(unique=True)#The unique identifier of the TikTok video. This is also called "item_id" or "video_id".
-    create_time = DateTimeField(null=True) #This is the time when the video was created.
-    user = ForeignKeyField(User, backref='videos', null=True)#This is the username of the video creator.
-    region = ForeignKeyField(Region, backref='videos', null=True) 
+    create_time = DateTimeField(null=True, index=True) #This is the time when the video was created.
+    # user and region are indexed together with create_time, see Meta
+    user = ForeignKeyField(User, backref='videos', null=True, index=False)#This is the username of the video creator.
+    region = ForeignKeyField(Region, backref='videos', null=True, index=False) 
     desc = TextField(null=True)#This is the description of the video.
-    music_id = BigIntegerField(null=True)#This is the music_id used in the video.
+    music_id = BigIntegerField(null=True, index=True)#This is the music_id used in the video.
     like_cnt = IntegerField(null=True)#The total number of likes on a TikTok video, created by users by clicking the “Heart” icon.
     comment_cnt = IntegerField(null=True)#This is the total number of comments posted on a video.
     share_cnt = IntegerField(null=True)#The total number of times a TikTok video has been shared by clicking the "Share" button with the video.
@@ -46,6 +48,11 @@ class Video(BaseModel):
     label_sink = BooleanField(default=False)
     label_type = IntegerField(default=0)
     label_vote = BooleanField(default=False)
+    class Meta:
+        indexes = (
+            (('region', 'create_time'), False),
+            (('user', 'create_time'), False),
+        )
 
 class Hashtag(BaseModel):
     tt_id = BigIntegerField()#Returns the unique hashtag_ids for each hashtag.
@@ -54,9 +61,12 @@ class Hashtag(BaseModel):
 
 class HashtagOnVideo(BaseModel):
     hashtag = ForeignKeyField(Hashtag, backref='videos')
-    video = ForeignKeyField(Video, backref='hashtags')#The list of hashtags used in the video.
+    video = ForeignKeyField(Video, backref='hashtags', index=False)#The list of hashtags used in the video.
     class Meta:
         primary_key = CompositeKey('hashtag', 'video')
+        indexes = (
+            (('video', 'hashtag'), False),
+        )
     
 class Effect(BaseModel):
     name = TextField()
@@ -75,7 +85,11 @@ class Comment(BaseModel):
     parent = ForeignKeyField('self', backref='childs', null=True)#This is the unique ID of the parent comment when the user responds to another user's comment. If the comment was directly entered for a video, this ID is the same as the Video ID.
     reply_cnt = IntegerField(default=0)#This is the total number of replies on a particular comment.
     text = TextField(null=True)#This is the actual text of the comment entered on a video. To protect the privacy of our users, other information is removed.
-    video = ForeignKeyField(Video, backref='comments', null=True)#This is the video ID for which the comment was entered.
+    video = ForeignKeyField(Video, backref='comments', null=True, index=False)#This is the video ID for which the comment was entered.
+    class Meta:
+        indexes = (
+            (('video', 'create_time'), False),
+        )
 
 class UserOnUser(BaseModel):#Following
     following = ForeignKeyField(User, backref='follower')
@@ -97,4 +111,27 @@ class VideoOnPlaylist(BaseModel):
     video = ForeignKeyField(Video, backref='playlists')
     playlist = ForeignKeyField(Playlist, backref='videos')
     class Meta:
-        primary_key = CompositeKey('playlist', 'video')
\ No newline at end of file
+        primary_key = CompositeKey('playlist', 'video')
+
+class ScrapeCheckpoint(BaseModel):#Progress of a video query, one row per date window
+    query_key = TextField()
+    start_date = DateTimeField()
+    end_date = DateTimeField()
+    cursor = IntegerField(default=0)
+    search_id = TextField(default='')
+    done = BooleanField(default=False)
+    class Meta:
+        indexes = (
+            (('query_key', 'start_date'), True),
+        )
+
+class CrawlFrontier(BaseModel):#Accounts queued and visited by a follower graph crawl
+    crawl = TextField()
+    username = TextField()
+    depth = IntegerField(default=0)
+    done = BooleanField(default=False)
+    class Meta:
+        indexes = (
+            (('crawl', 'username'), True),
+            (('crawl', 'done', 'depth'), False),
+        )
@@ -1,182 +1,457 @@
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 from datetime import datetime, timedelta
 from .tiktok_research_enums import *
+from .tiktok_research_planner import WindowPlanner
+from .tiktok_research_limiter import RateLimiter, QuotaExceeded
+from .tiktok_research_credentials import Credential, CredentialPool
+from .tiktok_research_transport import RequestsTransport
+from .tiktok_research_cache import TTLCache
+from .tiktok_research_records import video_record_type
+from .tiktok_research_metrics import Metrics, SIZE_BUCKETS
 from bs4 import BeautifulSoup
 import json
 import os
+import threading
 import time
 
 class TikTokResearch():
-    def __init__(self, client_key, client_secret, deltadays=1):
-        self.session = requests.Session()
-        self.base_address = 'https://open.tiktokapis.com/v2/'
+    def __init__(
+        self,
+        client_key,
+        client_secret,
+        deltadays=1,
+        adaptive_windows=False,
+        limiter:RateLimiter=None,
+        base_address='https://open.tiktokapis.com/v2/',
+        metrics:Metrics=None,
+        verbose:bool=False,
+        credentials:list=None,
+        transport=None
+    ):
+        # connection pool and JSON decoding of the API calls, see tiktok_research_transport
+        self.transport = transport or RequestsTransport()
+        self.session = self.transport.session
+        # counters and latency histograms, see tiktok_research_metrics; progress is only printed with verbose
+        self.metrics = metrics or Metrics()
+        self.verbose = verbose
+        # response size of the last request of the calling thread, summed up per date window
+        self.local = threading.local()
+        self.limiter = limiter or RateLimiter()
+        self.base_address = base_address
+        self.node_urls = {node: urljoin(base_address, node.value) for node in ApiNodes}
         self.client_key = client_key
         self.client_secret = client_secret
-        self.access_token = ''
-        self.token_type = ''
-        self.expires_in = 0
-        self.expire_ts = 0
-        self.get_token()
+        # further approved (client_key, client_secret) pairs or Credential objects, each with its own quota.
+        # Requests go to the credential with the most quota left, tokens are renewed before they expire.
+        pool = [Credential(client_key, client_secret, self.limiter)]
+        for credential in credentials or []:
+            if not isinstance(credential, Credential):
+                credential = Credential(credential[0], credential[1], self.limiter.clone())
+            pool.append(credential)
+        self.credentials = CredentialPool(pool, self.session, base_address, metrics=self.metrics, log=self.log)
+        self.credentials.refresh_all()
         # 1 day timedelta as workaround for TTAPI bug. Max 30 days possible
         # see: https://stackoverflow.com/questions/79023955/tiktok-query-videos-research-api-getting-search-id-is-invalid-or-expired
         self.time_delta = timedelta(days=deltadays)
+        # grow windows while results are sparse, shrink them when a window needs more than dense_pages pages
+        self.adaptive_windows = adaptive_windows
+        self.max_time_delta = timedelta(days=30)
+        self.sparse_pages = 1
+        self.dense_pages = 10
         self.max_count = 100
+        # values per IN condition of a video query, longer lists are split into several queries
+        self.max_query_values = 100
+        self.download_chunk_size = 1024 * 1024
+        self.download_timeout = 60
+        # user info barely changes during a scrape, cache it instead of asking for every video
+        self.user_cache = TTLCache(maxsize=10000, ttl=3600)
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
 
     def get_token(self):
-        res = self.session.post(
-            url = urljoin(self.base_address, ApiNodes.token.value), 
-            headers={
-                'Content-Type': 'application/x-www-form-urlencoded'
-            }, 
-            data={
-                'client_key': self.client_key,
-                'client_secret': self.client_secret,
-                'grant_type': 'client_credentials',
-            }
-        )
+        self.credentials.refresh_all()
 
-        if res.status_code == 200:
-            res_obj = res.json()
-            self.access_token = res_obj['access_token']
-            self.token_type = res_obj['token_type']
-            self.expires_in = res_obj['expires_in']
-            self.expire_ts =  int(time.time()) + self.expires_in
-        else:
-            raise Exception(f"Failed to obtain access token: {res.text}")
+    # the token attributes of the first credential, from the time there was only one
+    @property
+    def access_token(self):
+        return self.credentials.token()
+
+    @access_token.setter
+    def access_token(self, access_token:str):
+        # a token obtained elsewhere, used until the credential's expire_ts
+        credential = self.credentials.credentials[0]
+        with credential.lock:
+            credential.set_token(access_token)
+
+    @property
+    def token_type(self):
+        return self.credentials.credentials[0].token_type
+
+    @property
+    def expires_in(self):
+        return self.credentials.credentials[0].expires_in
+
+    @property
+    def expire_ts(self):
+        return self.credentials.credentials[0].expire_ts
 
     def api_request(self, node:ApiNodes, query, fields):
-        if int(time.time()) > self.expire_ts:
-            print("token expired - getting new one")
-            self.get_token()
-        res = self.session.post(
-            url = urljoin(self.base_address, node.value), 
-            headers={
-                'Authorization': 'Bearer '+self.access_token, 
-                'Content-Type': 'application/json'
-            }, 
-            json=query, 
-            params={
-                'fields': fields
-            }
-        )
+        attempt = 0
+        while True:
+            credential = self.credentials.acquire(node)
+            access_token = self.credentials.token(credential)
+            with self.metrics.timer('api_request_seconds', node=node.name):
+                res = self.transport.post_json(
+                    self.node_urls[node],
+                    query,
+                    params={
+                        'fields': fields
+                    },
+                    headers=credential.headers
+                )
+            self.local.response_bytes = len(res.content)
+            self.metrics.inc('api_requests_total', node=node.name, status=res.status_code)
+            self.metrics.inc('api_response_bytes_total', self.local.response_bytes, node=node.name)
+            if (res.status_code == 401) and (attempt < self.limiter.max_retries):
+                # token revoked or expired early, fetch a new one
+                self.log("token rejected - getting new one")
+                self.credentials.invalidate(credential, access_token)
+                attempt += 1
+                continue
+            if (res.status_code != 429) and (res.status_code < 500):
+                break
+            if res.status_code == 429:
+                try:
+                    error = res.json().get('error', {})
+                except ValueError:
+                    error = {}
+                if self.is_quota_error(error):
+                    self.metrics.inc('api_errors_total', node=node.name, code=error['code'])
+                    credential.limiter.exhaust(node)
+                    if self.credentials.available(node):
+                        continue
+                    raise QuotaExceeded(f"{error['code']}: {error.get('message', '')}\nLOG ID: {error.get('log_id', '')}")
+            if attempt >= self.limiter.max_retries:
+                self.metrics.inc('api_errors_total', node=node.name, code=str(res.status_code))
+                return None
+            self.log(f"{node.value}: status {res.status_code}, retrying")
+            self.metrics.inc('api_retries_total', node=node.name, status=res.status_code)
+            self.limiter.backoff(attempt, res.headers.get('Retry-After', None))
+            attempt += 1
         if res.status_code == 200:
-            error = res.json().get('error', {})
+            body = res.json()
+            error = body.get('error', {})
             if error['code'] != 'ok':
+                self.metrics.inc('api_errors_total', node=node.name, code=error['code'])
                 raise Exception(f"{error['code']}: {error['message']}\nLOG ID: {error['log_id']}")
-            return res.json().get('data', {})
+            return body.get('data', {})
         elif res.status_code == 400:
             error = res.json().get('error', {})
+            self.metrics.inc('api_errors_total', node=node.name, code=error.get('code', '400'))
             raise Exception(f"{error['code']}: {error['message']}\nLOG ID: {error['log_id']}")
         else:
             return None
 
-    def get_user(self, username: str, fields:list[UserFields]=UserFields.all()):
+    def is_quota_error(self, error:dict):
+        # the API answers a used up daily quota with 429 rate_limit_exceeded
+        # "... only 1000 requests are allowed per day.", other 429s are retried
+        code = error.get('code', '')
+        return ('quota' in code) or ((code == 'rate_limit_exceeded') and ('per day' in error.get('message', '')))
+
+    def remaining_budget(self, node:ApiNodes=ApiNodes.video):
+        # requests left today for the endpoint over all credentials, None if no daily limit is configured
+        return self.credentials.remaining(node)
+
+    def get_user(self, username: str, fields:list[UserFields]=UserFields.all(), cached:bool=True):
         if username == None:
             return None
         fields = ','.join([f.value for f in fields])
-        return self.api_request(
+        if cached:
+            user = self.user_cache.get((username, fields), None)
+            if user != None:
+                return user
+        user = self.api_request(
             node=ApiNodes.userinfo,
             query={
                 "username": username
             },
             fields=fields
         )
+        if user != None:
+            self.user_cache.set((username, fields), user)
+        return user
 
     def video_query(self, query, fields:list[VideoFields]):
         return self.api_request(node=ApiNodes.video, query=query, fields=fields)
 
-    def get_multiple_videos(
+    def date_windows(self, start_date:datetime, end_date:datetime, checkpoint=None):
+        return WindowPlanner(
+            start_date,
+            end_date,
+            self.time_delta,
+            checkpoint=checkpoint,
+            adaptive=self.adaptive_windows,
+            max_time_delta=self.max_time_delta,
+            sparse_pages=self.sparse_pages,
+            dense_pages=self.dense_pages
+        )
+
+    def iter_video_window(
+        self,
+        query,
+        start_date:datetime,
+        end_date:datetime,
+        fields:str,
+        cursor:int = 0,
+        search_id:str = ""
+    ):
+        # yields the raw response data of every page (videos, cursor, search_id, has_more)
+        has_more = True
+        res = {}
+        count_errors = 0
+        count_restarts = 0
+        # a search_id stored by an earlier run is usually expired already
+        resumed = search_id != ""
+        started = time.perf_counter()
+        window = {'pages': 0, 'items': 0, 'bytes': 0}
+        while has_more:
+            try:
+                self.log(start_date.strftime("%Y%m%d"), end_date.strftime("%Y%m%d"), cursor, search_id)
+                res = self.video_query(
+                    query = {
+                        "query": query,
+                        "max_count": self.max_count,
+                        "start_date": start_date.strftime("%Y%m%d"),
+                        "end_date": end_date.strftime("%Y%m%d"),
+                        "cursor": cursor,
+                        'search_id': search_id
+                    },
+                    fields=fields
+                )
+                if res == None: #api_request already retried with backoff, no result is the same pattern
+                    break
+                count_errors = 0
+            except QuotaExceeded:
+                raise
+            except Exception as e:
+                self.log(e)
+                self.metrics.inc('window_retries_total')
+                expired = (search_id != "") and ('is invalid or expired' in str(e))
+                if expired and (resumed or (count_errors >= self.limiter.max_retries)) and (count_restarts < self.limiter.max_retries):
+                    # the search_id is dead, the window starts over from its first page
+                    self.log("search_id", search_id, "expired, restarting the window")
+                    self.metrics.inc('window_restarts_total')
+                    cursor, search_id, resumed = 0, "", False
+                    count_errors = 0
+                    count_restarts += 1
+                    continue
+                if count_errors >= self.limiter.max_retries:
+                    raise
+                self.log("try again")
+                self.limiter.backoff(count_errors)
+                count_errors += 1
+                continue #handle the bug "Search Id XXXX is invalid or expired"
+
+            cursor = res.get('cursor', cursor)
+            search_id = res.get('search_id', search_id)
+            has_more = res.get('has_more', True)
+            window['pages'] += 1
+            window['items'] += len(res.get('videos', []))
+            window['bytes'] += getattr(self.local, 'response_bytes', 0)
+            yield res
+        self.record_window(start_date, end_date, window, time.perf_counter() - started)
+
+    def record_window(self, start_date:datetime, end_date:datetime, window:dict, seconds:float):
+        self.metrics.observe('window_pages', window['pages'], buckets=SIZE_BUCKETS)
+        self.metrics.observe('window_items', window['items'], buckets=SIZE_BUCKETS)
+        self.metrics.observe('window_bytes', window['bytes'], buckets=SIZE_BUCKETS)
+        self.metrics.observe('window_seconds', seconds)
+        self.metrics.event(
+            'window',
+            start_date=start_date.strftime("%Y%m%d"),
+            end_date=end_date.strftime("%Y%m%d"),
+            seconds=seconds,
+            **window
+        )
+
+    def map_bounded(self, func, args_list, workers:int=1):
+        # runs func(*args) for every entry of args_list with at most `workers` calls in flight,
+        # results are returned in input order
+        if workers <= 1:
+            for args in args_list:
+                yield func(*args)
+            return
+        self.transport.reserve(workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for args in args_list:
+                pending.append(executor.submit(func, *args))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def open_checkpoint(self, query, fields:str):
+        # TikTokResearch has no place to keep scrape state, see TikTokResearchDb
+        return None
+
+    def iter_multiple_videos(
         self,
         query,
         start_date:datetime = datetime(2018, 8, 2), 
         end_date:datetime = datetime.now(), 
-        fields:list[VideoFields]=VideoFields.all()
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        pages:bool = False,
+        resume:bool = False,
+        records:bool = False,
+        repoll_days:int = None
     ):
+        # records=True yields compact VideoRecord objects holding only the requested fields
+        record_type = video_record_type(fields) if records else None
         fields = ','.join([f.value for f in fields])
-        videos = []
-        temp_start_date = start_date
-        temp_end_date = start_date + self.time_delta
-        if temp_end_date > end_date:
-            temp_end_date = end_date
-
-        while(temp_start_date < end_date):
-            cursor = 0
-            search_id = ""
-            has_more = True
-            main_query = {}
-            res = {}
-            count_none_res = 0
-            while has_more:
-                try:
-                    print(temp_start_date.strftime("%Y%m%d"), temp_end_date.strftime("%Y%m%d"), cursor, search_id)
-                    res = self.video_query(
-                        query = {
-                            "query": query,
-                            "max_count": self.max_count,
-                            "start_date": temp_start_date.strftime("%Y%m%d"),
-                            "end_date": temp_end_date.strftime("%Y%m%d"),
-                            "cursor": cursor,
-                            'search_id': search_id
-                        },
-                        fields=fields
-                    )
-                    if res == None: #some request dont return result
-                        count_none_res += 1
-                        if count_none_res < 10:#sometimes the api hangs, but when there is no result its the same pattern
-                            time.sleep(2)
-                            continue
-                        else:
-                            break
-                    count_none_res = 0
-                except Exception as e:
-                    print(e)
-                    print("try again")
-                    time.sleep(2)
-                    continue #handle the bug "Search Id XXXX is invalid or expired"
-
-                cursor = res.get('cursor', cursor)
-                search_id = res.get('search_id', search_id)
-                has_more = res.get('has_more', True)
-                videos += res.get('videos', [])
-
-            temp_start_date += self.time_delta
-            temp_end_date += self.time_delta
-            if temp_end_date > end_date:
-                temp_end_date = end_date
-        return videos
+        checkpoint = self.open_checkpoint(query, fields) if resume else None
+        if (checkpoint != None) and (repoll_days != None):
+            # incremental run: finished windows are skipped except the last repoll_days days
+            checkpoint.reopen_tail(repoll_days)
+        windows = self.date_windows(start_date, end_date, checkpoint)
 
-    def get_videos_by_usernames(
+        def resume_windows():
+            for start, end in windows:
+                cursor, search_id = 0, ""
+                if checkpoint != None:
+                    cursor, search_id = checkpoint.resume(start)
+                yield start, end, cursor, search_id
+
+        if workers <= 1:
+            # stream page by page
+            window_pages = (
+                (start, end, self.iter_video_window(query, start, end, fields, cursor, search_id))
+                for start, end, cursor, search_id in resume_windows()
+            )
+        else:
+            # a worker fetches a whole window, pages are handed out once the window is done
+            window_pages = self.map_bounded(
+                lambda start, end, cursor, search_id: (
+                    start, end, list(self.iter_video_window(query, start, end, fields, cursor, search_id))
+                ),
+                resume_windows(),
+                workers
+            )
+        for start, end, window in window_pages:
+            page_count = 0
+            item_count = 0
+            # a window is complete once a page says has_more=False, iter_video_window stops early
+            # when api_request gives up
+            complete = False
+            for res in window:
+                complete = not res.get('has_more', True)
+                page = res.get('videos', [])
+                if record_type != None:
+                    page = [record_type(video) for video in page]
+                page_count += 1
+                item_count += len(page)
+                if pages:
+                    yield page
+                else:
+                    yield from page
+                # the consumer is done with the page, so the window can be resumed after it
+                if (checkpoint != None) and res.get('has_more', True):
+                    checkpoint.save_cursor(start, end, res.get('cursor', 0), res.get('search_id', ""))
+            windows.record(start, end, page_count, item_count)
+            if not complete:
+                # the saved cursor stays, a resumed run fetches the rest of the window
+                self.log("window", start.strftime("%Y%m%d"), end.strftime("%Y%m%d"), "is incomplete")
+                self.metrics.inc('windows_incomplete_total')
+            elif checkpoint != None:
+                checkpoint.mark_done(start, end)
+
+    def get_multiple_videos(
         self,
-        usernames:list[str], 
+        query,
         start_date:datetime = datetime(2018, 8, 2), 
         end_date:datetime = datetime.now(), 
-        fields:list[VideoFields]=VideoFields.all()
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        records:bool = False
     ):
-        query = {
+        return list(self.iter_multiple_videos(
+            query,
+            start_date,
+            end_date,
+            fields,
+            workers,
+            records=records
+        ))
+
+    def value_batches(self, values:list):
+        # the fewest batches within max_query_values, evenly sized, duplicates removed
+        values = list(dict.fromkeys(values))
+        if len(values) <= self.max_query_values:
+            return [values]
+        batch_count = -(-len(values) // self.max_query_values)
+        batch_size = -(-len(values) // batch_count)
+        return [values[i:i + batch_size] for i in range(0, len(values), batch_size)]
+
+    def iter_batched_videos(
+        self,
+        queries:list,
+        start_date:datetime = datetime(2018, 8, 2), 
+        end_date:datetime = datetime.now(), 
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        pages:bool = False,
+        resume:bool = False,
+        records:bool = False,
+        repoll_days:int = None
+    ):
+        # runs the queries one after another, a video matched by several of them is yielded once
+        if len(queries) == 1:
+            yield from self.iter_multiple_videos(
+                queries[0], start_date, end_date, fields, workers, pages, resume, records, repoll_days
+            )
+            return
+        # the ids are needed to find the duplicates, they are requested even if fields leave them out
+        # and dropped again before the videos are yielded
+        fetch_fields = list(fields)
+        drop_id = VideoFields.video_id not in fetch_fields
+        if drop_id:
+            fetch_fields.append(VideoFields.video_id)
+        record_type = video_record_type(fields) if records else None
+        seen = set()
+        for query in queries:
+            for page in self.iter_multiple_videos(
+                query, start_date, end_date, fetch_fields, workers, True, resume, records and not drop_id, repoll_days
+            ):
+                page = [video for video in page if (video.get('id') == None) or (video.get('id') not in seen)]
+                seen.update(video.get('id') for video in page)
+                if drop_id:
+                    for video in page:
+                        video.pop('id', None)
+                    if record_type != None:
+                        page = [record_type(video) for video in page]
+                if pages:
+                    if len(page) > 0:
+                        yield page
+                else:
+                    yield from page
+
+    def usernames_query(self, usernames:list[str]):
+        return {
             "and": [{
                 "operation": "IN", 
                 "field_name": "username", 
                 "field_values": usernames
             }]
         }
-        return self.get_multiple_videos(
-            query,
-            start_date, 
-            end_date, 
-            fields
-        )
 
-    def get_videos_by_hashtags(
-        self,
-        hashtags:list[str], 
-        region_codes: list[RegionCodes],
-        start_date:datetime = datetime(2018, 8, 2), 
-        end_date:datetime = datetime.now(), 
-        fields:list[VideoFields]=VideoFields.all()
-    ):
+    def hashtags_query(self, hashtags:list[str], region_codes: list[RegionCodes]):
         region_codes = [rc.value for rc in region_codes]
-        query =  {
+        return {
             "and": [
                 {
                     "operation": "IN", 
@@ -190,44 +465,155 @@ class TikTokResearch():
                 }
             ]
         }
-        return self.get_multiple_videos(
-            query,
+
+    def music_ids_query(self, music_ids:list[int]):
+        return {
+            "and": [{
+            "operation": "IN", 
+            "field_name": "music_id", 
+            "field_values": music_ids
+            }]
+        }
+
+    def iter_videos_by_usernames(
+        self,
+        usernames:list[str], 
+        start_date:datetime = datetime(2018, 8, 2), 
+        end_date:datetime = datetime.now(), 
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        pages:bool = False,
+        resume:bool = False,
+        records:bool = False,
+        repoll_days:int = None
+    ):
+        return self.iter_batched_videos(
+            [self.usernames_query(batch) for batch in self.value_batches(usernames)],
             start_date, 
             end_date, 
-            fields
+            fields,
+            workers,
+            pages,
+            resume,
+            records,
+            repoll_days
         )
 
-    def get_videos_by_music_ids(
+    def get_videos_by_usernames(
+        self,
+        usernames:list[str], 
+        start_date:datetime = datetime(2018, 8, 2), 
+        end_date:datetime = datetime.now(), 
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        records:bool = False
+    ):
+        return list(self.iter_videos_by_usernames(
+            usernames,
+            start_date, 
+            end_date, 
+            fields,
+            workers,
+            records=records
+        ))
+
+    def iter_videos_by_hashtags(
+        self,
+        hashtags:list[str], 
+        region_codes: list[RegionCodes],
+        start_date:datetime = datetime(2018, 8, 2), 
+        end_date:datetime = datetime.now(), 
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        pages:bool = False,
+        resume:bool = False,
+        records:bool = False,
+        repoll_days:int = None
+    ):
+        return self.iter_batched_videos(
+            [self.hashtags_query(batch, region_codes) for batch in self.value_batches(hashtags)],
+            start_date, 
+            end_date, 
+            fields,
+            workers,
+            pages,
+            resume,
+            records,
+            repoll_days
+        )
+
+    def get_videos_by_hashtags(
+        self,
+        hashtags:list[str], 
+        region_codes: list[RegionCodes],
+        start_date:datetime = datetime(2018, 8, 2), 
+        end_date:datetime = datetime.now(), 
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        records:bool = False
+    ):
+        return list(self.iter_videos_by_hashtags(
+            hashtags,
+            region_codes,
+            start_date, 
+            end_date, 
+            fields,
+            workers,
+            records=records
+        ))
+
+    def iter_videos_by_music_ids(
         self,
         music_ids:list[int], 
         start_date:datetime = datetime(2018, 8, 2), 
         end_date:datetime = datetime.now(), 
-        fields:list[VideoFields]=VideoFields.all()
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        pages:bool = False,
+        resume:bool = False,
+        records:bool = False,
+        repoll_days:int = None
     ):
-        query = {
-            "and": [{
-            "operation": "IN", 
-            "field_name": "music_id", 
-            "field_values": music_ids
-            }]
-        }
-        return self.get_multiple_videos(
-            query,
+        return self.iter_batched_videos(
+            [self.music_ids_query(batch) for batch in self.value_batches(music_ids)],
             start_date, 
             end_date, 
-            fields
+            fields,
+            workers,
+            pages,
+            resume,
+            records,
+            repoll_days
         )
 
-    def get_paginated_items(
+    def get_videos_by_music_ids(
+        self,
+        music_ids:list[int], 
+        start_date:datetime = datetime(2018, 8, 2), 
+        end_date:datetime = datetime.now(), 
+        fields:list[VideoFields]=VideoFields.all(),
+        workers:int = 1,
+        records:bool = False
+    ):
+        return list(self.iter_videos_by_music_ids(
+            music_ids,
+            start_date, 
+            end_date, 
+            fields,
+            workers,
+            records=records
+        ))
+
+    def iter_paginated_items(
         self, 
         node:ApiNodes,
         query,
         item_name: str,
         fields = None,
+        pages:bool = False
     ):
         query['max_count'] = self.max_count
         query['cursor'] = 0
-        items = []
         has_more = True
         while(has_more):
             try:
@@ -240,42 +626,78 @@ class TikTokResearch():
                     break
                 query['cursor'] = res['cursor']
                 has_more = res['has_more']
-                items += res[item_name]
+                items = res[item_name]
+            except QuotaExceeded:
+                raise
             except Exception as e:
-                print(e)
-                return items
-        return items
+                self.log(e)
+                return
+            if pages:
+                yield items
+            else:
+                yield from items
 
-        
-    def get_comments(
+    def get_paginated_items(
+        self, 
+        node:ApiNodes,
+        query,
+        item_name: str,
+        fields = None,
+    ):
+        return list(self.iter_paginated_items(
+            node = node,
+            query = query,
+            item_name = item_name,
+            fields = fields
+        ))
+
+    def iter_comments(
         self, 
         video_id:int, 
-        fields:list[CommentFields]=CommentFields.all()
+        fields:list[CommentFields]=CommentFields.all(),
+        pages:bool = False
     ):
         fields = ','.join([f.value for f in fields])
-        return self.get_paginated_items(
+        return self.iter_paginated_items(
             node=ApiNodes.comments,
             query={
                 'video_id': video_id
             },
             fields=fields,
-            item_name='comments'
+            item_name='comments',
+            pages=pages
         )
 
-    def get_user_liked_videos(
+    def get_comments(
+        self, 
+        video_id:int, 
+        fields:list[CommentFields]=CommentFields.all()
+    ):
+        return list(self.iter_comments(video_id, fields))
+
+    def iter_user_liked_videos(
         self,
         username: str,
-        fields:list[VideoSmallFields]=VideoSmallFields.all()
+        fields:list[VideoSmallFields]=VideoSmallFields.all(),
+        pages:bool = False
     ):
         fields = ','.join([f.value for f in fields])
-        return self.get_paginated_items(
+        return self.iter_paginated_items(
             node=ApiNodes.userlikes,
             query={
                 'username': username
             },
             item_name='user_liked_videos',
-            fields=fields
+            fields=fields,
+            pages=pages
         )
+
+    def get_user_liked_videos(
+        self,
+        username: str,
+        fields:list[VideoSmallFields]=VideoSmallFields.all()
+    ):
+        return list(self.iter_user_liked_videos(username, fields))
             
     def get_user_pinned_videos(
         self,
@@ -291,45 +713,70 @@ class TikTokResearch():
             fields=fields
         )['pinned_videos_list']
             
-    def get_user_followers(
+    def iter_user_followers(
         self,
-        username: str
+        username: str,
+        pages:bool = False
     ):
-        return self.get_paginated_items(
+        return self.iter_paginated_items(
             node=ApiNodes.userfollowers,
             query={
                 'username': username
             },
             item_name='user_followers',
+            pages=pages
         )
 
-    def get_user_following(
+    def get_user_followers(
         self,
         username: str
     ):
-        return self.get_paginated_items(
+        return list(self.iter_user_followers(username))
+
+    def iter_user_following(
+        self,
+        username: str,
+        pages:bool = False
+    ):
+        return self.iter_paginated_items(
             node=ApiNodes.userfollowing,
             query={
                 'username': username
             },
             item_name='user_following',
+            pages=pages
         )
 
-    def get_user_reposts(
+    def get_user_following(
+        self,
+        username: str
+    ):
+        return list(self.iter_user_following(username))
+
+    def iter_user_reposts(
         self,
         username: str,
-        fields:list[VideoSmallFields]=VideoSmallFields.all()
+        fields:list[VideoSmallFields]=VideoSmallFields.all(),
+        pages:bool = False
     ):
         fields = ','.join([f.value for f in fields])
-        return self.get_paginated_items(
+        return self.iter_paginated_items(
             node=ApiNodes.userreposts,
             query={
                 'username': username
             },
             item_name='user_reposted_videos',
-            fields=fields
+            fields=fields,
+            pages=pages
         )
 
+    def get_user_reposts(
+        self,
+        username: str,
+        fields:list[VideoSmallFields]=VideoSmallFields.all()
+    ):
+        return list(self.iter_user_reposts(username, fields))
+
     def get_playlist(
         self,
         playlist_id: int
@@ -341,11 +788,53 @@ class TikTokResearch():
             }
         )
 
+    def download_file(self, url:str, file_path:str, headers=None, cookies=None):
+        # streams url to disk in chunks through the pooled session, an existing file is kept
+        # and an interrupted .part file is resumed with a Range request
+        if os.path.exists(file_path):
+            return file_path
+        part_path = file_path + '.part'
+        headers = dict(headers or {})
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > 0:
+            headers['Range'] = f'bytes={offset}-'
+        try:
+            with self.session.get(
+                url, 
+                allow_redirects=True, 
+                headers=headers,
+                cookies=cookies,
+                stream=True,
+                timeout=self.download_timeout
+            ) as res:
+                if res.status_code == 416: #the part file already has every byte
+                    os.replace(part_path, file_path)
+                    return file_path
+                if res.status_code not in (200, 206):
+                    self.log("download_file: status", res.status_code, "for", url)
+                    self.metrics.inc('downloads_total', status=str(res.status_code))
+                    return None
+                mode = 'ab' if res.status_code == 206 else 'wb' #server ignored the Range header
+                with self.metrics.timer('download_seconds'), open(part_path, mode) as fn:
+                    for chunk in res.iter_content(chunk_size=self.download_chunk_size):
+                        fn.write(chunk)
+                        self.metrics.inc('download_bytes_total', len(chunk))
+        except Exception as e:
+            self.log(e)
+            self.metrics.inc('downloads_total', status='error')
+            return None
+        os.replace(part_path, file_path)
+        self.metrics.inc('downloads_total', status='ok')
+        return file_path
+
     def download_video(self, username:str, video_id:int, path: str = '.'):
+        video_fn = os.path.join(path, username+'_'+str(video_id)+'.mp4')
+        if os.path.exists(video_fn):
+            return video_fn
         url = 'https://www.tiktok.com/@'+username+"/video/"+str(video_id)
         headers={'Authorization': 'Bearer '+self.access_token,}
         tt = self.session.get(url, headers=headers)
-        print(tt)
+        self.log(tt)
         cookies = tt.cookies
         soup = BeautifulSoup(tt.text, "html.parser")
         tt_video_url = ''
@@ -355,47 +844,32 @@ class TikTokResearch():
             tt_video_url = (tt_json.get("__DEFAULT_SCOPE__", {}).get('webapp.video-detail', {}).get(
                 'itemInfo', {}).get('itemStruct', {}).get('video', {}).get('playAddr', ''))
         else:
-            print("try alternative")
+            self.log("try alternative")
             tt_script = soup.find('script', attrs={'id':"SIGI_STATE"})
             if tt_script == None:
-                print(tt.text)
+                self.log(tt.text)
                 return
             tt_json = json.loads(tt_script.string)
-            print(tt_json)
+            self.log(tt_json)
             tt_video_url = tt_json.get('ItemModule', {}).get(video_id, {}).get('video', {}).get('downloadAddr', '')
         if tt_video_url == '':
-            print("download_video: Found no video URL for", username, str(video_id))
-            return None
-        try:
-            tt_video = requests.get(
-                tt_video_url, 
-                allow_redirects=True, 
-                headers=headers,
-                cookies=cookies
-                )
-        except Exception as e:
-            print(e)
+            self.log("download_video: Found no video URL for", username, str(video_id))
             return None
-        video_fn = os.path.join(path, username+'_'+str(video_id)+'.mp4')
-        with open(video_fn, 'wb') as fn:
-            fn.write(tt_video.content)
-        return video_fn
+        return self.download_file(
+            tt_video_url,
+            video_fn,
+            headers=headers,
+            cookies=cookies
+        )
 
     def download_avatar(self, user, path):
         if ('display_name' in user) and ('avatar_url' in user):
             headers={'Authorization': 'Bearer '+self.access_token,}
-            try:
-                avatar = requests.get(
-                    user['avatar_url'], 
-                    allow_redirects=True,
-                    headers=headers
-                )
-            except Exception as e:
-                print(e)
-                return None
             avatar_path = os.path.join(path, 'avatar_'+user['display_name']+'.jpg')
-            with open(avatar_path, 'wb') as fn:
-                fn.write(avatar.content)
-            return avatar_path
+            return self.download_file(
+                user['avatar_url'],
+                avatar_path,
+                headers=headers
+            )
         else:
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+from .tiktok_research_enums import *
+from .tiktok_research_fake_server import FakeResearchApi
+from .tiktok_research import TikTokResearch
+from .tiktok_research_db import TikTokResearchDb
+from .peewee_db_model import *
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+# End-to-end throughput benchmarks against the local FakeResearchApi, no quota is spent.
+# Run with: python -m tiktok_research.tiktok_research_benchmark --days 30 --workers 8
+
+DB_TABLES = [User, Video, Region, Hashtag, HashtagOnVideo, Comment]
+
+def count_rows():
+    return sum(model.select().count() for model in DB_TABLES)
+
+class Benchmark():
+    def __init__(self, api:FakeResearchApi, days:int = 10, workers:int = 4, db_dir:str = None):
+        self.api = api
+        self.days = days
+        self.workers = workers
+        self.db_dir = db_dir or tempfile.mkdtemp(prefix='ttr_bench_')
+        self.start_date = datetime(2024, 1, 1)
+        self.end_date = self.start_date + timedelta(days=days)
+        self.results = []
+
+    def client(self):
+        return TikTokResearch('fake_key', 'fake_secret', base_address=self.api.base_address)
+
+    def db_client(self, name:str, **kwargs):
+        db_path = os.path.join(self.db_dir, name + '.sqlite')
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return TikTokResearchDb(
+            'fake_key',
+            'fake_secret',
+            db_path,
+            files_path=os.path.join(self.db_dir, 'files'),
+            base_address=self.api.base_address,
+            **kwargs
+        )
+
+    def measure(self, name:str, func, db:bool = False):
+        self.api.reset_stats()
+        rows_before = count_rows() if db else 0
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            videos = func()
+        elapsed = time.perf_counter() - started
+        rows = (count_rows() - rows_before) if db else 0
+        requests = sum(self.api.requests.values())
+        result = {
+            'name': name,
+            'seconds': elapsed,
+            'requests': requests,
+            'requests_s': requests / elapsed,
+            'videos': videos,
+            'videos_s': videos / elapsed,
+            'rows': rows,
+            'rows_s': rows / elapsed,
+            'errors': sum(count for status, count in self.api.responses.items() if status != 200),
+        }
+        self.results.append(result)
+        return result
+
+    def run(self):
+        client = self.client()
+        hashtags = ['fyp']
+        regions = [RegionCodes.germany]
+        self.measure('get_multiple_videos serial', lambda: len(
+            client.get_videos_by_hashtags(hashtags, regions, self.start_date, self.end_date)
+        ))
+        self.measure(f'get_multiple_videos workers={self.workers}', lambda: len(
+            client.get_videos_by_hashtags(hashtags, regions, self.start_date, self.end_date, workers=self.workers)
+        ))
+        self.measure('iter_multiple_videos serial', lambda: sum(
+            1 for _ in client.iter_videos_by_hashtags(hashtags, regions, self.start_date, self.end_date)
+        ))
+        ttr = self.db_client('row_by_row')
+        self.measure('scrape_videos_by_hashtag bulk=False', lambda: ttr.scrape_videos_by_hashtag(
+            hashtags, regions, self.start_date, self.end_date, bulk=False, resume=False, count_only=True
+        ), db=True)
+        ttr = self.db_client('bulk')
+        self.measure('scrape_videos_by_hashtag bulk=True', lambda: ttr.scrape_videos_by_hashtag(
+            hashtags, regions, self.start_date, self.end_date, resume=False, count_only=True
+        ), db=True)
+        ttr = self.db_client('concurrent')
+        self.measure(f'scrape_videos_by_hashtag workers={self.workers}', lambda: ttr.scrape_videos_by_hashtag(
+            hashtags, regions, self.start_date, self.end_date, workers=self.workers, resume=False, count_only=True
+        ), db=True)
+        self.measure(f'harvest_comments workers={self.workers}', lambda: (
+            ttr.harvest_comments(workers=self.workers)
+        ), db=True)
+        ttr = self.db_client('writer', background_writer=True)
+        self.measure(f'scrape_videos_by_hashtag writer workers={self.workers}', lambda: ttr.scrape_videos_by_hashtag(
+            hashtags, regions, self.start_date, self.end_date, workers=self.workers, resume=False, count_only=True
+        ), db=True)
+        ttr.close_writer()
+        return self.results
+
+    def report(self):
+        lines = [
+            f"{'benchmark':<42} {'s':>8} {'req':>7} {'req/s':>9} {'items':>8} {'items/s':>10} {'rows/s':>10} {'errors':>7}"
+        ]
+        for r in self.results:
+            lines.append(
+                f"{r['name']:<42} {r['seconds']:>8.2f} {r['requests']:>7} {r['requests_s']:>9.1f} "
+                f"{r['videos']:>8} {r['videos_s']:>10.1f} {r['rows_s']:>10.1f} {r['errors']:>7}"
+            )
+        return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput benchmarks against a local fake Research API')
+    parser.add_argument('--days', type=int, default=10)
+    parser.add_argument('--videos-per-day', type=int, default=200)
+    parser.add_argument('--comments-per-video', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0)
+    parser.add_argument('--expire-rate', type=float, default=0)
+    parser.add_argument('--db-dir', default=None)
+    args = parser.parse_args()
+    with FakeResearchApi(
+        videos_per_day=args.videos_per_day,
+        comments_per_video=args.comments_per_video,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        expire_rate=args.expire_rate
+    ) as api:
+        benchmark = Benchmark(api, days=args.days, workers=args.workers, db_dir=args.db_dir)
+        benchmark.run()
+        print(benchmark.report())
+
+if __name__ == '__main__':
+    main()
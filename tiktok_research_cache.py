@@ -0,0 +1,47 @@
+from collections import OrderedDict
+import threading
+import time
+
+class TTLCache():
+    # Thread-safe LRU cache. Entries expire after ttl seconds (ttl=None keeps them until
+    # evicted), the least recently used entry is evicted once maxsize is reached.
+    def __init__(self, maxsize:int = 10000, ttl:float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry != None:
+                value, expire_ts = entry
+                if (expire_ts == None) or (expire_ts > time.monotonic()):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            expire_ts = None if self.ttl == None else time.monotonic() + self.ttl
+            self.entries[key] = (value, expire_ts)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return default if entry == None else entry[0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from .peewee_db_model import ScrapeCheckpoint
+import hashlib
+import json
+
+def query_key(query, fields:str):
+    # same query and fields -> same key, independent of the scraped date range
+    raw = json.dumps({'query': query, 'fields': fields}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class DbCheckpoint():
+    # Keeps finished and interrupted date windows of one video query in the ScrapeCheckpoint table
+    def __init__(self, query, fields:str, persist=None, log=None):
+        self.query_key = query_key(query, fields)
+        # writes go through persist so they stay in order with the pages when a DbWriter is used
+        self.persist = persist or (lambda func, *args: func(*args))
+        self.log = log or (lambda *args: None)
+        self.windows = {
+            row.start_date: row
+            for row in ScrapeCheckpoint.select().where(ScrapeCheckpoint.query_key == self.query_key)
+        }
+
+    def skip_done(self, start_date:datetime):
+        moved = True
+        while moved:
+            moved = False
+            for row in self.windows.values():
+                if row.done and (row.start_date <= start_date < row.end_date):
+                    start_date = row.end_date
+                    moved = True
+        return start_date
+
+    def next_done_start(self, start_date:datetime):
+        starts = [row.start_date for row in self.windows.values() if row.done and row.start_date > start_date]
+        if len(starts) == 0:
+            return None
+        return min(starts)
+
+    def in_flight_end(self, start_date:datetime):
+        row = self.windows.get(start_date, None)
+        if (row == None) or row.done:
+            return None
+        return row.end_date
+
+    def resume(self, start_date:datetime):
+        row = self.windows.get(start_date, None)
+        if (row == None) or row.done:
+            return 0, ""
+        self.log("resuming window", start_date.strftime("%Y%m%d"), row.cursor, row.search_id)
+        return row.cursor, row.search_id
+
+    def db_save(self, start_date:datetime, end_date:datetime, cursor:int, search_id:str, done:bool):
+        ScrapeCheckpoint.insert(
+            query_key = self.query_key,
+            start_date = start_date,
+            end_date = end_date,
+            cursor = cursor,
+            search_id = search_id,
+            done = done
+        ).on_conflict(
+            conflict_target=[ScrapeCheckpoint.query_key, ScrapeCheckpoint.start_date],
+            preserve=[ScrapeCheckpoint.end_date, ScrapeCheckpoint.cursor, ScrapeCheckpoint.search_id, ScrapeCheckpoint.done]
+        ).execute()
+
+    def save(self, start_date:datetime, end_date:datetime, cursor:int, search_id:str, done:bool):
+        self.persist(self.db_save, start_date, end_date, cursor, search_id, done)
+        self.windows[start_date] = ScrapeCheckpoint(
+            query_key = self.query_key,
+            start_date = start_date,
+            end_date = end_date,
+            cursor = cursor,
+            search_id = search_id,
+            done = done
+        )
+
+    def save_cursor(self, start_date:datetime, end_date:datetime, cursor:int, search_id:str):
+        self.save(start_date, end_date, cursor, search_id, False)
+
+    def mark_done(self, start_date:datetime, end_date:datetime):
+        self.save(start_date, end_date, 0, "", True)
+
+    def high_water_mark(self):
+        # end of the latest finished window
+        ends = [row.end_date for row in self.windows.values() if row.done]
+        if len(ends) == 0:
+            return None
+        return max(ends)
+
+    def db_reopen(self, since:datetime):
+        ScrapeCheckpoint.delete().where(
+            (ScrapeCheckpoint.query_key == self.query_key) & (ScrapeCheckpoint.end_date > since)
+        ).execute()
+
+    def reopen(self, since:datetime):
+        # forgets the windows reaching past since, so they are fetched again
+        self.persist(self.db_reopen, since)
+        self.windows = {
+            start_date: row for start_date, row in self.windows.items() if row.end_date <= since
+        }
+
+    def reopen_tail(self, days:int):
+        # re-polls the last `days` days before the high-water mark
+        high_water_mark = self.high_water_mark()
+        if high_water_mark == None:
+            return None
+        since = high_water_mark - timedelta(days=days)
+        self.log("incremental from", since.strftime("%Y%m%d"), "high-water mark", high_water_mark.strftime("%Y%m%d"))
+        self.reopen(since)
+        return since
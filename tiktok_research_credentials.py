@@ -0,0 +1,164 @@
+from urllib.parse import urljoin
+from .tiktok_research_enums import ApiNodes
+from .tiktok_research_limiter import RateLimiter, QuotaExceeded
+import threading
+import time
+
+class Credential():
+    # One approved client key/secret pair with its access token. The Research API counts the
+    # quota per client, so every credential has its own RateLimiter.
+    def __init__(self, client_key:str, client_secret:str, limiter:RateLimiter = None):
+        self.client_key = client_key
+        self.client_secret = client_secret
+        self.limiter = limiter or RateLimiter()
+        self.lock = threading.Lock()
+        self.access_token = ''
+        self.token_type = ''
+        self.expires_in = 0
+        self.expire_ts = 0
+        # headers of the API calls, built once per token
+        self.headers = {}
+
+    def set_token(self, access_token:str):
+        self.access_token = access_token
+        self.headers = {
+            'Authorization': 'Bearer ' + access_token,
+            'Content-Type': 'application/json'
+        }
+
+class CredentialPool():
+    # Hands out the credential with the most daily quota left for an endpoint (the least used
+    # one among unlimited credentials) and keeps their tokens fresh. A token is renewed
+    # refresh_margin seconds before it expires: one thread renews it while the others keep
+    # using the still valid token, only an expired token makes the callers wait.
+    def __init__(self, credentials:list[Credential], session, base_address:str, refresh_margin:float = 300, metrics = None, log = None):
+        if len(credentials) == 0:
+            raise ValueError("CredentialPool needs at least one credential")
+        self.credentials = credentials
+        self.session = session
+        self.base_address = base_address
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresher = None
+        self.metrics = metrics
+        self.log = log or (lambda *args: None)
+
+    def request_token(self, credential:Credential):
+        res = self.session.post(
+            url = urljoin(self.base_address, ApiNodes.token.value),
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded'
+            },
+            data={
+                'client_key': credential.client_key,
+                'client_secret': credential.client_secret,
+                'grant_type': 'client_credentials',
+            }
+        )
+
+        if res.status_code == 200:
+            res_obj = res.json()
+            credential.set_token(res_obj['access_token'])
+            credential.token_type = res_obj['token_type']
+            credential.expires_in = res_obj['expires_in']
+            credential.expire_ts = int(time.time()) + credential.expires_in
+            if self.metrics != None:
+                self.metrics.inc('token_refreshes_total', credential=str(self.credentials.index(credential)))
+        else:
+            raise Exception(f"Failed to obtain access token: {res.text}")
+
+    def needs_refresh(self, credential:Credential, margin:float):
+        return credential.expire_ts - margin <= time.time()
+
+    def token(self, credential:Credential = None):
+        credential = credential or self.credentials[0]
+        if not self.needs_refresh(credential, self.refresh_margin):
+            return credential.access_token
+        if not self.needs_refresh(credential, 0):
+            # still valid, whoever gets the lock renews it
+            if credential.lock.acquire(blocking=False):
+                try:
+                    if self.needs_refresh(credential, self.refresh_margin):
+                        self.request_token(credential)
+                finally:
+                    credential.lock.release()
+            return credential.access_token
+        with credential.lock:
+            if self.needs_refresh(credential, 0):
+                self.request_token(credential)
+        return credential.access_token
+
+    def invalidate(self, credential:Credential, access_token:str):
+        # the API rejected the token, the next token() call fetches a new one
+        with credential.lock:
+            if credential.access_token == access_token:
+                credential.expire_ts = 0
+
+    def refresh_all(self):
+        for credential in self.credentials:
+            with credential.lock:
+                self.request_token(credential)
+
+    def quota_order(self, node:ApiNodes):
+        def remaining(credential):
+            left = credential.limiter.remaining(node)
+            return float('inf') if left == None else left
+        candidates = [c for c in self.credentials if remaining(c) > 0]
+        return sorted(candidates, key=lambda c: (-remaining(c), c.limiter.used(node)))
+
+    def acquire(self, node:ApiNodes):
+        # counts one request against a credential, the one with most quota left that is not at its
+        # window limit. Waits if all are at their window limit, raises QuotaExceeded when all are used up.
+        while True:
+            wait = None
+            with self.lock:
+                candidates = self.quota_order(node)
+                if len(candidates) == 0:
+                    raise QuotaExceeded(f"daily quota for {node.value} used up on all {len(self.credentials)} credentials")
+                for credential in candidates:
+                    try:
+                        credential_wait = credential.limiter.try_acquire(node)
+                    except QuotaExceeded:
+                        continue
+                    if credential_wait <= 0:
+                        return credential
+                    wait = credential_wait if wait == None else min(wait, credential_wait)
+            if wait != None:
+                time.sleep(wait)
+
+    def available(self, node:ApiNodes):
+        return len(self.quota_order(node)) > 0
+
+    def remaining(self, node:ApiNodes):
+        # daily requests left over all credentials, None if one of them is unlimited
+        total = 0
+        for credential in self.credentials:
+            left = credential.limiter.remaining(node)
+            if left == None:
+                return None
+            total += left
+        return total
+
+    def start_refresher(self, interval:float = 30):
+        # renews the tokens in the background, so no request has to wait for one
+        def run():
+            while not self.stopped.wait(interval):
+                for credential in self.credentials:
+                    if self.needs_refresh(credential, self.refresh_margin):
+                        try:
+                            with credential.lock:
+                                if self.needs_refresh(credential, self.refresh_margin):
+                                    self.request_token(credential)
+                        except Exception as e:
+                            self.log("token refresh failed:", e)
+        self.refresher = threading.Thread(target=run, name='TokenRefresher', daemon=True)
+        self.refresher.start()
+        return self
+
+    def stop_refresher(self):
+        if self.refresher != None:
+            self.stopped.set()
+            self.refresher.join()
+            self.refresher = None
+            self.stopped.clear()
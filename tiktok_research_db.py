@@ -1,60 +1,254 @@
 from .tiktok_research import TikTokResearch
 from .tiktok_research_enums import *
-from datetime import datetime
+from datetime import datetime, timedelta
 from .peewee_db_model import *
+from .tiktok_research_checkpoint import DbCheckpoint
+from .tiktok_research_writer import DbWriter
+from .tiktok_research_queries import TikTokResearchQueries
+from .tiktok_research_search import TikTokResearchSearch
+from .tiktok_research_export import DbExporter
+from .tiktok_research_cache import TTLCache
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from playhouse.migrate import SqliteMigrator, migrate
 import os
 
-class TikTokResearchDb(TikTokResearch):
-    def __init__(self, client_key, client_secret, db_path, files_path='.', deltadays=1):
-        super().__init__(client_key, client_secret, deltadays)
+class TikTokResearchDb(TikTokResearch, TikTokResearchQueries, TikTokResearchSearch):
+    db_tables = [
+        User, Video, 
+        Region, 
+        Hashtag, HashtagOnVideo, 
+        Comment,
+        ScrapeCheckpoint,
+        UserOnUser,
+        CrawlFrontier,
+        # Effect, EffectOnVideo,
+        # UserOnVideo,
+        # Playlist,
+        # VideoOnPlaylist
+    ]
+
+    def __init__(self, client_key, client_secret, db_path, files_path='.', deltadays=1, background_writer=False, full_text_search=True, **kwargs):
+        super().__init__(client_key, client_secret, deltadays, **kwargs)
         self.db_path = db_path
         Path(files_path).mkdir(parents=True, exist_ok=True)
         self.files_path = files_path
+        self.bulk_size = 100
+        self.comment_workers = 4
+        self.comment_batch_size = 1000
+        self.download_workers = 4
+        self.graph_workers = 4
+        self.graph_batch_size = 100
+        # stored user info younger than this is used without asking the API, None always asks
+        self.user_max_age = timedelta(days=1)
+        # WAL lets the fetch thread read while the writer commits, synchronous=normal only
+        # fsyncs on checkpoints in WAL mode
+        self.db_pragmas = {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -64 * 1024,
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'memory',
+            'busy_timeout': 30000,
+        }
+        # dimension rows by name, every video refers to one of a few regions and popular hashtags
+        self.region_cache = TTLCache(maxsize=1000)
+        self.hashtag_cache = TTLCache(maxsize=100000)
+        # FTS5 indexes over video descriptions, transcripts and comments, see tiktok_research_search.
+        # Missing indexes are created and filled when the db is opened, existing ones are kept
+        self.full_text_search = full_text_search
+        self.writer = None
         self.init_db()
+        if background_writer:
+            self.start_writer()
     
     def init_db(self):
         self.db = db
-        self.db.init(self.db_path)
+        self.db.init(self.db_path, pragmas=self.db_pragmas)
         # self.db.drop_tables([
         #     User, Video, 
         #     Region, 
         #     Hashtag, HashtagOnVideo, 
         #     UserOnVideo,
         # ])
-        self.db.create_tables([
-            User, Video, 
-            Region, 
-            Hashtag, HashtagOnVideo, 
-            Comment,
-            # Effect, EffectOnVideo,
-            # UserOnUser,
-            # UserOnVideo,
-            # Playlist,
-            # VideoOnPlaylist
-        ])
+        self.migrate_db(self.db_tables)
+        self.db.create_tables(self.db_tables)
+        if self.full_text_search:
+            self.init_search()
+        self.warm_dimension_caches()
+
+    def migrate_db(self, tables):
+        # adds columns and indexes that were added to the models after the db file was created and
+        # drops the foreign key indexes that a composite index of the model replaced
+        migrator = SqliteMigrator(self.db)
+        indexes_added = False
+        for model in tables:
+            table_name = model._meta.table_name
+            if not self.db.table_exists(table_name):
+                continue
+            columns = {c.name for c in self.db.get_columns(table_name)}
+            for field in model._meta.sorted_fields:
+                if field.column_name not in columns:
+                    self.log("adding column", table_name, field.column_name)
+                    migrate(migrator.add_column(table_name, field.column_name, field))
+            existing = {index.name for index in self.db.get_indexes(table_name)}
+            for field in model._meta.sorted_fields:
+                name = f'{table_name}_{field.column_name}'
+                if isinstance(field, ForeignKeyField) and (not field.index) and (not field.unique) and (name in existing):
+                    self.log("dropping index", table_name, name)
+                    self.db.execute_sql(f'DROP INDEX "{name}"')
+            for index in model._meta.fields_to_index():
+                if index._name not in existing:
+                    self.log("adding index", table_name, index._name)
+                    self.db.execute(index)
+                    indexes_added = True
+        if indexes_added:
+            # fresh statistics so the query planner picks the new indexes
+            self.db.execute_sql('ANALYZE')
     
+    def start_writer(self, max_queue:int = 100, batch_size:int = 20, commit_interval:float = 1.0):
+        # from now on persist() hands the writes to a background thread
+        self.writer = DbWriter(
+            self.db,
+            max_queue=max_queue,
+            batch_size=batch_size,
+            commit_interval=commit_interval,
+            metrics=self.metrics,
+            on_error=lambda e: self.clear_dimension_caches()
+        ).start()
+        return self.writer
+
+    def close_writer(self):
+        if self.writer != None:
+            writer, self.writer = self.writer, None
+            writer.close()
+
+    def persist(self, func, *args, **kwargs):
+        if self.writer != None:
+            self.writer.submit(func, *args, **kwargs)
+            return None
+        try:
+            with self.metrics.timer('db_write_seconds', op=getattr(func, '__name__', 'write')):
+                return func(*args, **kwargs)
+        except Exception:
+            self.clear_dimension_caches()
+            raise
+
+    def flush(self):
+        if self.writer != None:
+            self.writer.flush()
+
+    def export(
+        self,
+        out_dir:str,
+        tables:list[str] = None,
+        format:str = 'parquet',
+        compression:str = 'zstd',
+        incremental:bool = True,
+        chunk_size:int = 50000
+    ):
+        self.flush()
+        exporter = DbExporter(self.db, out_dir, format=format, compression=compression, chunk_size=chunk_size, log=self.log)
+        return exporter.export(tables=tables, incremental=incremental)
+
+    def open_checkpoint(self, query, fields:str):
+        return DbCheckpoint(query, fields, persist=self.persist, log=self.log)
+
+    def clear_dimension_caches(self):
+        # after a rolled back write the caches may hold rows that were never committed
+        self.region_cache.clear()
+        self.hashtag_cache.clear()
+
+    def warm_dimension_caches(self):
+        # all regions and the most used hashtags, the most used one ends up most recently used
+        self.clear_dimension_caches()
+        for region_db in Region.select():
+            self.region_cache.set(region_db.name, region_db)
+        uses = fn.COUNT(HashtagOnVideo.video)
+        popular = (HashtagOnVideo
+            .select(HashtagOnVideo.hashtag, uses.alias('uses'))
+            .group_by(HashtagOnVideo.hashtag)
+            .order_by(uses.desc())
+            .limit(self.hashtag_cache.maxsize)
+        )
+        query = (Hashtag
+            .select()
+            .join(popular, on=(Hashtag.id == popular.c.hashtag_id))
+            .order_by(popular.c.uses)
+        )
+        for hashtag_db in query:
+            self.hashtag_cache.set(hashtag_db.name, hashtag_db)
+
     def db_create_region(self, region_code):
         if region_code == None:
             return None
-        region_db, _ = Region.get_or_create(
-            name = region_code,
-            defaults = {
-                'desc': RegionCodes.to_rev_dict().get(region_code, '')
-            }
-        )
+        region_db = self.region_cache.get(region_code)
+        if region_db == None:
+            region_db, _ = Region.get_or_create(
+                name = region_code,
+                defaults = {
+                    'desc': RegionCodes.to_rev_dict().get(region_code, '')
+                }
+            )
+            self.region_cache.set(region_code, region_db)
         return region_db
 
     def db_create_hashtag(self, hashtag):
-        hashtag_db, _ =  Hashtag.get_or_create(
-            tt_id = hashtag['hashtag_id'],
-            name = hashtag['hashtag_name'],
-            defaults = {
-                'desc': hashtag['hashtag_description'],
-            }
-        )
+        hashtag_db = self.hashtag_cache.get(hashtag['hashtag_name'])
+        if hashtag_db == None:
+            hashtag_db, _ =  Hashtag.get_or_create(
+                tt_id = hashtag['hashtag_id'],
+                name = hashtag['hashtag_name'],
+                defaults = {
+                    'desc': hashtag['hashtag_description'],
+                }
+            )
+            self.hashtag_cache.set(hashtag['hashtag_name'], hashtag_db)
         return hashtag_db
 
+    def db_region_ids(self, region_names:list[str]):
+        # region name -> Region id, only names missing in region_cache hit the db
+        region_ids = {}
+        missing = []
+        for name in region_names:
+            region_db = self.region_cache.get(name)
+            if region_db == None:
+                missing.append(name)
+            else:
+                region_ids[name] = region_db.id
+        if len(missing) > 0:
+            region_desc = RegionCodes.to_rev_dict()
+            Region.insert_many([
+                {'name': name, 'desc': region_desc.get(name, '')} for name in missing
+            ]).on_conflict_ignore().execute()
+            for region_db in Region.select().where(Region.name.in_(missing)):
+                self.region_cache.set(region_db.name, region_db)
+                region_ids[region_db.name] = region_db.id
+        return region_ids
+
+    def db_hashtag_ids(self, hashtags:dict):
+        # hashtag name -> Hashtag id for a dict name -> hashtag info, see db_region_ids
+        hashtag_ids = {}
+        missing = []
+        for name, hashtag in hashtags.items():
+            hashtag_db = self.hashtag_cache.get(name)
+            if hashtag_db == None:
+                missing.append(hashtag)
+            else:
+                hashtag_ids[name] = hashtag_db.id
+        for batch in chunked(missing, self.bulk_size):
+            Hashtag.insert_many([
+                {
+                    'tt_id': ht['hashtag_id'],
+                    'name': ht['hashtag_name'],
+                    'desc': ht.get('hashtag_description', None)
+                } for ht in batch
+            ]).on_conflict_ignore().execute()
+            for hashtag_db in Hashtag.select().where(Hashtag.name.in_([ht['hashtag_name'] for ht in batch])):
+                self.hashtag_cache.set(hashtag_db.name, hashtag_db)
+                hashtag_ids[hashtag_db.name] = hashtag_db.id
+        return hashtag_ids
+
     def db_create_hashtags(self, hashtag_info_list):
         if len(hashtag_info_list) == 0:
             return []
@@ -81,10 +275,11 @@ class TikTokResearchDb(TikTokResearch):
                 'avatar_url': user.get('avatar_url', None),
                 'avatar_path': avatar_path,
                 'is_verified': user.get('is_verified', None),
+                'updated_at': datetime.now() if len(user) > 0 else None,
             }
         )
         if (not created) and (update):
-            print("User already in set! updating...")
+            self.log("User already in set! updating...")
             User.update(
                 following_cnt = user.get('following_count', None),
                 follower_cnt = user.get('follower_count', None),
@@ -94,18 +289,61 @@ class TikTokResearchDb(TikTokResearch):
                 bio_url = user.get('bio_url', None),
                 displayname = user.get('display_name', None),
                 avatar_url = user.get('avatar_url', None),
-                avatar_path = avatar_path,
+                avatar_path = avatar_path or user_db.avatar_path,
                 is_verified = user.get('is_verified', None),
+                updated_at = datetime.now() if len(user) > 0 else None,
             ).where(User.username == username).execute()
         return user_db
     
+    def db_bulk_user_ids(self, users:list[dict]):
+        # inserts the users that are not stored yet (stored ones are left as they are),
+        # returns username -> User id
+        user_ids = {}
+        for batch in chunked(users, self.bulk_size):
+            User.insert_many(batch).on_conflict_ignore().execute()
+            user_ids.update(
+                User.select(User.username, User.id).where(User.username.in_([u['username'] for u in batch])).tuples()
+            )
+        return user_ids
+
+    def db_fresh_user(self, username):
+        # stored user whose info is younger than user_max_age
+        if self.user_max_age == None:
+            return None
+        return User.get_or_none(
+            (User.username == username) & (User.updated_at >= datetime.now() - self.user_max_age)
+        )
+
+    def db_fetch_user(self, username, download=False):
+        # stored user if its info is fresh, otherwise asks the (cached) API
+        if username == None:
+            return None
+        user_db = self.db_fresh_user(username)
+        if user_db != None:
+            return user_db
+        user = self.get_user(username=username)
+        # a failed request keeps the stored (stale) info instead of wiping it
+        return self.db_create_user(
+            username = username,
+            user = user or {},
+            update = user != None,
+            download = download
+        )
+
+    def db_fetch_page_users(self, page:list[dict]):
+        # full info of the page's users that is missing or stale, the API calls stay in this thread
+        usernames = dict.fromkeys(video['username'] for video in page if video.get('username', None) != None)
+        for username in usernames:
+            if self.db_fresh_user(username) != None:
+                continue
+            user = self.get_user(username=username)
+            if user != None:
+                self.persist(self.db_create_user, username=username, user=user, update=True)
+
     def db_get_or_create_user(self, username, download=False):
         if download:
-            user = self.get_user(username)
-            return self.db_create_user(
+            return self.db_fetch_user(
                 username = username,
-                user = user,
-                update=True,
                 download = download
             )
         else:
@@ -122,12 +360,8 @@ class TikTokResearchDb(TikTokResearch):
         user_db = None
         username = video.get('username', None)
         if download:
-            user_db = self.db_create_user(
-                username = username,
-                user = self.get_user(username=username),
-                update=True,
-                download = download
-            )
+            # the files are fetched by download_media once the rows exist
+            user_db = self.db_fetch_user(username=username)
         else:
             user_db = self.db_create_user(
                 username = username,
@@ -137,15 +371,7 @@ class TikTokResearchDb(TikTokResearch):
             )
         video_labels = video.get('video_label', {})
 
-        video_path = None
-        if download and ('username' in video) and ('id' in video):
-            video_path = self.download_video(
-                username = video['username'],
-                video_id = video['id'],
-                path = self.files_path
-            )
-
-        video_db, _ = Video.get_or_create(
+        video_db, created = Video.get_or_create(
             item_id = video.get('id'),
             defaults = {
                 'create_time': datetime.fromtimestamp(video.get('create_time', None)),
@@ -167,9 +393,14 @@ class TikTokResearchDb(TikTokResearch):
                 'label_sink': video_labels.get('sink', False),
                 'label_type': video_labels.get('type', False),
                 'label_vote': video_labels.get('vote', False),
-                'path': video_path
             }
         )
+        if update and not created:
+            video_db.like_cnt = video.get('like_count', None)
+            video_db.comment_cnt = video.get('comment_count', None)
+            video_db.share_cnt = video.get('share_count', None)
+            video_db.view_cnt = video.get('view_count', None)
+            video_db.save(only=[Video.like_cnt, Video.comment_cnt, Video.share_cnt, Video.view_cnt])
 
         for hashtag_db in hashtags_db:#connect hashtags with video
             HashtagOnVideo.get_or_create(
@@ -177,56 +408,379 @@ class TikTokResearchDb(TikTokResearch):
                 video = video_db
             )
 
+        if download and ('id' in video):
+            self.download_media(video_ids=[video['id']])
+
         if comments:
             self.scrape_comments_by_video_id(video_id=video.get('id'))
 
         return video_db
 
-    def db_create_videos(self, videos, comments:bool=False, download:bool=False):
+    def db_create_videos(self, videos, comments:bool=False, download:bool=False, update:bool=False, bulk:bool=False):
         if len(videos) == 0:
             return None
+        if bulk:
+            return self.db_bulk_create_videos(
+                videos=videos,
+                comments=comments,
+                update=update,
+                download=download
+            )
         return [
             self.db_create_video(
                 video=video, 
                 comments=comments,
+                update=update,
                 download=download) 
                 for video in videos
             ]
+
+    def db_bulk_create_videos(self, videos, comments:bool=False, update:bool=False, download:bool=False):
+        # writes a page of videos with multi-row upserts in one transaction, returns the Video ids
+        if len(videos) == 0:
+            return []
+        region_names = list(dict.fromkeys(v['region_code'] for v in videos if v.get('region_code', None) != None))
+        hashtags = {ht['hashtag_name']: ht for v in videos for ht in v.get('hashtag_info_list', [])}
+        usernames = list(dict.fromkeys(v['username'] for v in videos if v.get('username', None) != None))
+
+        if download:
+            # the files are fetched by download_media once the rows exist
+            for username in usernames:
+                self.db_fetch_user(username=username)
+
+        with self.db.atomic():
+            region_ids = self.db_region_ids(region_names)
+            hashtag_ids = self.db_hashtag_ids(hashtags)
+            user_ids = self.db_bulk_user_ids([{'username': u} for u in usernames])
+
+            rows = []
+            for video in videos:
+                video_labels = video.get('video_label', {})
+                create_time = video.get('create_time', None)
+                rows.append({
+                    'item_id': video.get('id'),
+                    'create_time': datetime.fromtimestamp(create_time) if create_time != None else None,
+                    'user': user_ids.get(video.get('username', None), None),
+                    'region': region_ids.get(video.get('region_code', None), None),
+                    'desc': video.get('video_description', None),
+                    'music_id': video.get('music_id', None),
+                    'like_cnt': video.get('like_count', None),
+                    'comment_cnt': video.get('comment_count', None),
+                    'share_cnt': video.get('share_count', None),
+                    'view_cnt': video.get('view_count', None),
+                    'voice_to_text': video.get('voice_to_text', None),
+                    'is_stem_verified': video.get('is_stem_verified', None),
+                    'duration': video.get('video_duration', None),
+                    'label_warn': video_labels.get('warn', False),
+                    'label_content': video_labels.get('content', False),
+                    'label_sink': video_labels.get('sink', False),
+                    'label_type': video_labels.get('type', False),
+                    'label_vote': video_labels.get('vote', False),
+                })
+            for batch in chunked(rows, self.bulk_size):
+                query = Video.insert_many(batch)
+                if update:
+                    query = query.on_conflict(
+                        conflict_target=[Video.item_id],
+                        preserve=[Video.like_cnt, Video.comment_cnt, Video.share_cnt, Video.view_cnt]
+                    )
+                else:
+                    query = query.on_conflict_ignore()
+                query.execute()
+
+            item_ids = [row['item_id'] for row in rows]
+            video_ids = {}
+            for batch in chunked(item_ids, self.bulk_size):
+                video_ids.update(Video.select(Video.item_id, Video.id).where(Video.item_id.in_(batch)).tuples())
+
+            links = [
+                {'hashtag': hashtag_ids[ht['hashtag_name']], 'video': video_ids[video['id']]}
+                for video in videos
+                for ht in video.get('hashtag_info_list', [])
+                if video.get('id') in video_ids
+            ]
+            for batch in chunked(links, self.bulk_size):
+                HashtagOnVideo.insert_many(batch).on_conflict_ignore().execute()
+
+        if download:
+            self.download_media(video_ids=item_ids)
+
+        if comments:
+            for item_id in item_ids:
+                self.scrape_comments_by_video_id(video_id=item_id)
+
+        return [video_ids[item_id] for item_id in item_ids if item_id in video_ids]
     
     def db_create_comment(self, db_video:Video, comment):
         db_parent = None
         parent_id = comment.get('parent_comment_id', None)
-        if parent_id != None:
-            db_parent, _ =Comment.get_or_create(tt_id=parent_id)
-        db_comment, _ = Comment.get_or_create(
+        # top-level comments name their video as parent
+        if (parent_id != None) and (parent_id != comment.get('video_id', db_video.item_id)):
+            db_parent, _ = Comment.get_or_create(tt_id=parent_id, defaults={'video': db_video})
+        create_time = comment.get('create_time', None)
+        db_comment, created = Comment.get_or_create(
             tt_id= comment.get('id', None),
             defaults={
                 'video': db_video,
-                'create_time': datetime.fromtimestamp(comment.get('create_time', None)),
+                'create_time': datetime.fromtimestamp(create_time) if create_time != None else None,
                 'text': comment.get('text', None),
                 'parent': db_parent,
-                'like_cnt': comment.get('like_count', None),
-                'reply_cnt': comment.get('reply_count', None)
+                'like_cnt': comment.get('like_count', 0),
+                'reply_cnt': comment.get('reply_count', 0)
             }
         )
+        if (not created) and (db_comment.text == None):
+            # placeholder of a parent that arrived after its replies
+            Comment.update(
+                video = db_video,
+                create_time = datetime.fromtimestamp(create_time) if create_time != None else None,
+                text = comment.get('text', None),
+                parent = db_parent,
+                like_cnt = comment.get('like_count', 0),
+                reply_cnt = comment.get('reply_count', 0)
+            ).where(Comment.id == db_comment.id).execute()
         return db_comment
     
     def db_create_comments(self, db_video:Video, comments):
+        # returns the stored Comment objects in the order of comments
         if len(comments) == 0:
             return None
-        return [
-                self.db_create_comment(
-                    db_video=db_video,
-                    comment=comment) 
-                    for comment in comments
+        self.db_bulk_create_comments([(db_video.item_id, comments)])
+        tt_ids = [comment['id'] for comment in comments if comment.get('id', None) != None]
+        stored = {}
+        for batch in chunked(tt_ids, self.bulk_size):
+            stored.update((c.tt_id, c) for c in Comment.select().where(Comment.tt_id.in_(batch)))
+        return [stored[tt_id] for tt_id in dict.fromkeys(tt_ids) if tt_id in stored]
+
+    def db_bulk_create_comments(self, video_comments:list):
+        # writes the comments of (video item_id, comments) pairs in two passes: one multi-row upsert
+        # keyed on tt_id, then one UPDATE that points the replies at their parents. A parent that is
+        # not stored yet gets a placeholder row, which is filled in when the parent itself arrives.
+        # Returns the number of comments.
+        rows = {}
+        parents = {}
+        for video_id, comments in video_comments:
+            for comment in comments:
+                if comment.get('id', None) == None:
+                    continue
+                create_time = comment.get('create_time', None)
+                rows[comment['id']] = {
+                    'tt_id': comment['id'],
+                    'video': video_id,
+                    'create_time': datetime.fromtimestamp(create_time) if create_time != None else None,
+                    'text': comment.get('text', None),
+                    'like_cnt': comment.get('like_count', 0),
+                    'reply_cnt': comment.get('reply_count', 0),
+                }
+                parent_id = comment.get('parent_comment_id', None)
+                # top-level comments name their video as parent
+                parents[comment['id']] = None if parent_id == comment.get('video_id', video_id) else parent_id
+        if len(rows) == 0:
+            return 0
+
+        with self.db.atomic():
+            video_ids = {}
+            item_ids = list(dict.fromkeys(video_id for video_id, _ in video_comments))
+            for batch in chunked(item_ids, self.bulk_size):
+                Video.insert_many([{'item_id': item_id} for item_id in batch]).on_conflict_ignore().execute()
+                video_ids.update(Video.select(Video.item_id, Video.id).where(Video.item_id.in_(batch)).tuples())
+            for row in rows.values():
+                row['video'] = video_ids[row['video']]
+
+            for batch in chunked(list(rows.values()), self.bulk_size):
+                Comment.insert_many(batch).on_conflict(
+                    conflict_target=[Comment.tt_id],
+                    preserve=[Comment.video, Comment.create_time, Comment.text, Comment.like_cnt, Comment.reply_cnt]
+                ).execute()
+
+            placeholders = [
+                {'tt_id': parent_id, 'video': rows[tt_id]['video']}
+                for tt_id, parent_id in parents.items()
+                if (parent_id != None) and (parent_id not in rows)
             ]
-    
+            for batch in chunked(placeholders, self.bulk_size):
+                Comment.insert_many(batch).on_conflict_ignore().execute()
+
+            self.db.execute_sql(
+                'CREATE TEMP TABLE IF NOT EXISTS comment_parent (tt_id INTEGER PRIMARY KEY, parent_tt_id INTEGER)'
+            )
+            for batch in chunked(list(parents.items()), self.bulk_size):
+                self.db.execute_sql(
+                    'INSERT OR REPLACE INTO comment_parent (tt_id, parent_tt_id) VALUES ' + ', '.join(['(?, ?)'] * len(batch)),
+                    [value for pair in batch for value in pair]
+                )
+            # a correlated subquery instead of UPDATE ... FROM, which needs sqlite 3.33
+            self.db.execute_sql(
+                'UPDATE comment SET parent_id = ('
+                'SELECT p.id FROM comment_parent cp JOIN comment p ON p.tt_id = cp.parent_tt_id '
+                'WHERE cp.tt_id = comment.tt_id'
+                ') WHERE tt_id IN (SELECT tt_id FROM comment_parent)'
+            )
+            self.db.execute_sql('DELETE FROM comment_parent')
+        return len(rows)
+
     def scrape_comments_by_video_id(self, video_id:int):
-        db_video, _ = Video.get_or_create(item_id=video_id)
-        self.db_create_comments(
-            db_video=db_video, 
-            comments=self.get_comments(video_id=video_id)
+        count = 0
+        for page in self.iter_comments(video_id=video_id, pages=True):
+            count += self.db_bulk_create_comments([(video_id, page)])
+        return count
+
+    def db_prune_comment_placeholders(self):
+        # older versions stored the video of a top-level comment as a placeholder parent comment
+        # with the tt_id of the video, those comments become top-level and the placeholders go
+        placeholders = Comment.select(Comment.id).join(Video, on=(Video.item_id == Comment.tt_id)).where(Comment.text.is_null())
+        with self.db.atomic():
+            Comment.update(parent=None).where(Comment.parent.in_(placeholders)).execute()
+            return Comment.delete().where(Comment.id.in_(placeholders)).execute()
+
+    def videos_without_comments(self):
+        # item_ids of stored videos that have comments on TikTok but none in the db
+        has_comments = Comment.select(Comment.id).where(Comment.video == Video.id)
+        return [
+            item_id for (item_id, ) in Video.select(Video.item_id).where(
+                (Video.comment_cnt > 0) & ~fn.EXISTS(has_comments)
+            ).tuples()
+        ]
+
+    def db_create_comment_batch(self, batch):
+        return self.db_bulk_create_comments(batch)
+
+    def harvest_comments(self, video_ids:list[int]=None, workers:int=None):
+        # fetches the comments of many videos concurrently, this thread writes them in batches
+        if video_ids == None:
+            video_ids = self.videos_without_comments()
+        if workers == None:
+            workers = self.comment_workers
+        fetched = self.map_bounded(
+            lambda video_id: (video_id, self.get_comments(video_id=video_id)),
+            ((video_id, ) for video_id in video_ids),
+            workers
+        )
+        batch = []
+        batch_size = 0
+        count = 0
+        try:
+            for video_id, comments in fetched:
+                batch.append((video_id, comments))
+                batch_size += len(comments)
+                count += len(comments)
+                if batch_size >= self.comment_batch_size:
+                    self.persist(self.db_create_comment_batch, batch)
+                    batch = []
+                    batch_size = 0
+        finally:
+            self.persist(self.db_create_comment_batch, batch)
+        return count
+
+    def pending_downloads(self, video_ids:list[int]=None):
+        # videos without a file and users with an avatar url but without a file
+        videos = Video.select(Video.id, Video.item_id, User.username).join(User).where(Video.path.is_null())
+        users = User.select(User.id, User.displayname, User.avatar_url).where(
+            User.avatar_path.is_null() & User.avatar_url.is_null(False)
         )
+        if video_ids != None:
+            videos = videos.where(Video.item_id.in_(video_ids))
+            users = users.where(User.id.in_(
+                Video.select(Video.user).where(Video.item_id.in_(video_ids))
+            ))
+        jobs = [('video', row_id, username, item_id) for row_id, item_id, username in videos.tuples()]
+        jobs += [('avatar', row_id, displayname, avatar_url) for row_id, displayname, avatar_url in users.tuples()]
+        return jobs
+
+    def download_media_item(self, kind:str, row_id:int, name:str, value):
+        try:
+            if kind == 'video':
+                path = self.download_video(
+                    username = name,
+                    video_id = value,
+                    path = self.files_path
+                )
+            else:
+                path = self.download_avatar(
+                    user = {'display_name': name, 'avatar_url': value},
+                    path = self.files_path
+                )
+        except Exception as e: #one broken download must not stop the others
+            self.log(e)
+            self.metrics.inc('downloads_total', status='error')
+            path = None
+        return kind, row_id, path
+
+    def db_set_media_paths(self, results):
+        with self.db.atomic():
+            for kind, row_id, path in results:
+                if kind == 'video':
+                    Video.update(path=path).where(Video.id == row_id).execute()
+                else:
+                    User.update(avatar_path=path).where(User.id == row_id).execute()
+
+    def download_media(self, video_ids:list[int]=None, workers:int=None):
+        # downloads pending video files and avatars concurrently, returns the number of stored files
+        if workers == None:
+            workers = self.download_workers
+        jobs = [job for job in self.pending_downloads(video_ids) if job[2] != None]
+        results = []
+        count = 0
+        try:
+            for kind, row_id, path in self.map_bounded(self.download_media_item, jobs, workers):
+                if path == None:
+                    continue
+                results.append((kind, row_id, path))
+                count += 1
+                if len(results) >= self.bulk_size:
+                    self.persist(self.db_set_media_paths, results)
+                    results = []
+        finally:
+            self.persist(self.db_set_media_paths, results)
+        return count
+
+    def db_videos(self, item_ids:list[int]):
+        # the stored Video objects in the order of item_ids
+        stored = {}
+        for batch in chunked(item_ids, self.bulk_size):
+            stored.update((v.item_id, v) for v in Video.select().where(Video.item_id.in_(batch)))
+        return [stored[item_id] for item_id in item_ids if item_id in stored]
+
+    def db_create_video_pages(self, pages, comments:bool=False, update:bool=False, download:bool=False, bulk:bool=True, count_only:bool=False):
+        # persists every page as soon as it is fetched. Returns the stored Video objects (None if
+        # there were no videos) or with count_only the number of videos, which keeps nothing in memory.
+        # The files of a page are downloaded in a background thread while the next page is fetched
+        count = 0
+        item_ids = None if count_only else {}
+        downloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='download') if download else None
+        downloads = []
+        try:
+            for page in pages:
+                # files and user info are fetched here, so persist() only writes
+                self.persist(self.db_create_videos, videos=page, update=update, bulk=bulk)
+                if download:
+                    self.db_fetch_page_users(page)
+                    # download_media only finds the rows once they are committed
+                    self.flush()
+                    downloads.append(downloader.submit(
+                        self.download_media,
+                        video_ids=[video['id'] for video in page if 'id' in video]
+                    ))
+                    # failed downloads surface here instead of after the whole scrape
+                    while (len(downloads) > 0) and downloads[0].done():
+                        downloads.pop(0).result()
+                if comments:
+                    self.harvest_comments(video_ids=[video['id'] for video in page if 'id' in video])
+                if item_ids != None:
+                    item_ids.update((video['id'], None) for video in page if 'id' in video)
+                count += len(page)
+            for future in downloads:
+                future.result()
+        finally:
+            if downloader != None:
+                downloader.shutdown(wait=True)
+        self.flush()
+        self.log(f'L={count}')
+        if count_only:
+            return count
+        if count == 0:
+            return None
+        return self.db_videos(list(item_ids))
 
     def scrape_videos_by_hashtag(
         self, 
@@ -235,19 +789,33 @@ class TikTokResearchDb(TikTokResearch):
         start_date: datetime,
         end_date: datetime,
         comments: bool=False,
-        download: bool=False
+        download: bool=False,
+        workers: int=1,
+        update: bool=False,
+        bulk: bool=True,
+        resume: bool=False,
+        incremental: bool=False,
+        repoll_days: int=0,
+        fields: list[VideoFields]=VideoFields.all(),
+        count_only: bool=False
     ):
-        videos = self.get_videos_by_hashtags(
-            hashtags, 
-            region_codes,
-            start_date,
-            end_date
-        )
-        print(f'L={len(videos)}')
-        return self.db_create_videos(
-            videos = videos, 
+        return self.db_create_video_pages(
+            pages = self.iter_videos_by_hashtags(
+                hashtags, 
+                region_codes,
+                start_date,
+                end_date,
+                fields=fields,
+                workers=workers,
+                pages=True,
+                resume=resume or incremental,
+                repoll_days=repoll_days if incremental else None
+            ),
             comments=comments,
-            download = download
+            update=update or (incremental and repoll_days > 0),
+            download = download,
+            bulk=bulk,
+            count_only=count_only
         )
     
     def scrape_videos_by_usernames(
@@ -256,18 +824,32 @@ class TikTokResearchDb(TikTokResearch):
         start_date: datetime,
         end_date: datetime,
         comments: bool=False,
-        download: bool=False
+        download: bool=False,
+        workers: int=1,
+        update: bool=False,
+        bulk: bool=True,
+        resume: bool=False,
+        incremental: bool=False,
+        repoll_days: int=0,
+        fields: list[VideoFields]=VideoFields.all(),
+        count_only: bool=False
     ):
-        videos = self.get_videos_by_usernames(
-            usernames, 
-            start_date,
-            end_date
-        )
-        print(f'L={len(videos)}')
-        return self.db_create_videos(
-            videos = videos, 
+        return self.db_create_video_pages(
+            pages = self.iter_videos_by_usernames(
+                usernames, 
+                start_date,
+                end_date,
+                fields=fields,
+                workers=workers,
+                pages=True,
+                resume=resume or incremental,
+                repoll_days=repoll_days if incremental else None
+            ),
             comments=comments,
-            download = download
+            update=update or (incremental and repoll_days > 0),
+            download = download,
+            bulk=bulk,
+            count_only=count_only
         )
     
     def scrape_videos_by_music_ids(
@@ -276,20 +858,119 @@ class TikTokResearchDb(TikTokResearch):
         start_date: datetime,
         end_date: datetime,
         comments: bool=False,
-        download: bool=False
+        download: bool=False,
+        workers: int=1,
+        update: bool=False,
+        bulk: bool=True,
+        resume: bool=False,
+        incremental: bool=False,
+        repoll_days: int=0,
+        fields: list[VideoFields]=VideoFields.all(),
+        count_only: bool=False
     ):
-        videos = self.get_videos_by_music_ids(
-            music_ids, 
-            start_date,
-            end_date
-        )
-        print(f'L={len(videos)}')
-        return self.db_create_videos(
-            videos = videos, 
+        return self.db_create_video_pages(
+            pages = self.iter_videos_by_music_ids(
+                music_ids, 
+                start_date,
+                end_date,
+                fields=fields,
+                workers=workers,
+                pages=True,
+                resume=resume or incremental,
+                repoll_days=repoll_days if incremental else None
+            ),
             comments=comments,
-            download = download
+            update=update or (incremental and repoll_days > 0),
+            download = download,
+            bulk=bulk,
+            count_only=count_only
+        )
+
+    def fetch_user_edges(self, username:str, followers:bool = True, following:bool = True):
+        return (
+            self.get_user_followers(username) if followers else [],
+            self.get_user_following(username) if following else []
         )
 
+    def db_create_user_edges(self, username:str, followers:list, following:list):
+        # stores the users and UserOnUser rows of one account, returns the usernames of its neighbours
+        neighbours = {}
+        for user in followers + following:
+            if user.get('username', None) != None:
+                neighbours[user['username']] = {'username': user['username'], 'displayname': user.get('display_name', None)}
+        with self.db.atomic():
+            user_ids = self.db_bulk_user_ids([{'username': username, 'displayname': None}] + list(neighbours.values()))
+            user_id = user_ids[username]
+            edges = [
+                {'following': user_id, 'follower': user_ids[user['username']]}
+                for user in followers if user.get('username', None) != None
+            ] + [
+                {'following': user_ids[user['username']], 'follower': user_id}
+                for user in following if user.get('username', None) != None
+            ]
+            for batch in chunked(edges, self.bulk_size):
+                UserOnUser.insert_many(batch).on_conflict_ignore().execute()
+        return list(neighbours)
+
+    def db_add_to_frontier(self, crawl:str, usernames:list[str], depth:int):
+        # users already in the frontier were visited or are queued, they are not added again
+        for batch in chunked(list(dict.fromkeys(usernames)), self.bulk_size):
+            CrawlFrontier.insert_many([
+                {'crawl': crawl, 'username': username, 'depth': depth} for username in batch
+            ]).on_conflict_ignore().execute()
+
+    def db_store_crawl_step(self, crawl:str, username:str, depth:int, max_depth:int, followers:list, following:list):
+        with self.db.atomic():
+            neighbours = self.db_create_user_edges(username, followers, following)
+            if depth + 1 < max_depth:
+                self.db_add_to_frontier(crawl, neighbours, depth + 1)
+            CrawlFrontier.update(done=True).where(
+                (CrawlFrontier.crawl == crawl) & (CrawlFrontier.username == username)
+            ).execute()
+
+    def crawl_user_graph(
+        self,
+        seeds:list[str],
+        max_depth:int = 1,
+        followers:bool = True,
+        following:bool = True,
+        workers:int = None,
+        crawl:str = 'default',
+        limit:int = None
+    ):
+        # breadth-first crawl of the follower/following graph. Seeds have depth 0, the accounts of
+        # depth < max_depth are expanded. The frontier lives in the crawlfrontier table, so calling
+        # again with the same crawl name continues a stopped crawl, limit stops after that many accounts.
+        workers = workers or self.graph_workers
+        self.persist(self.db_add_to_frontier, crawl, seeds, 0)
+        self.flush()
+        count = 0
+        while (limit == None) or (count < limit):
+            batch_size = self.graph_batch_size if limit == None else min(self.graph_batch_size, limit - count)
+            batch = list(
+                CrawlFrontier.select()
+                .where((CrawlFrontier.crawl == crawl) & (CrawlFrontier.done == False))
+                .order_by(CrawlFrontier.depth, CrawlFrontier.id)
+                .limit(batch_size)
+            )
+            if len(batch) == 0:
+                break
+            results = self.map_bounded(
+                self.fetch_user_edges,
+                [(row.username, followers, following) for row in batch],
+                workers
+            )
+            for row, (user_followers, user_following) in zip(batch, results):
+                self.persist(
+                    self.db_store_crawl_step,
+                    crawl, row.username, row.depth, max_depth, user_followers, user_following
+                )
+                count += 1
+            # the next batch is read from the frontier, so it has to contain this one
+            self.flush()
+            self.log("crawled", count, "accounts, depth", batch[-1].depth)
+        return count
+
     def scrape_user_by_name(
         self,
         username: str,
@@ -298,11 +979,12 @@ class TikTokResearchDb(TikTokResearch):
         follower = False,
         following = False
     ):
-        return self.db_create_user(
-            username = username,
-            user = self.get_user(username=username),
-            update=True,
-        )
+        user_db = self.db_fetch_user(username=username)
+        if follower or following:
+            user_followers, user_following = self.fetch_user_edges(username, follower, following)
+            self.persist(self.db_create_user_edges, username, user_followers, user_following)
+            self.flush()
+        return user_db
             
     def scrape_users_by_names(
         self,
@@ -315,7 +997,7 @@ class TikTokResearchDb(TikTokResearch):
                 res = self.scrape_user_by_name(username, download_avatar)
                 users.append(res)
             except Exception as e:
-                print(e)
+                self.log(e)
         return users  
 
 
@@ -0,0 +1,317 @@
+from datetime import datetime
+from peewee import SqliteDatabase
+import argparse
+import gzip
+import json
+import os
+import re
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Streams the scrape db out with raw cursor reads, chunk_size rows at a time, into one file per
+# table: Parquet, Arrow IPC or JSONL (zstd/gzip compressed). Incremental exports only write rows
+# with an id above the last exported one, tracked per table in export_state.json in out_dir.
+# Rows are not versioned, so changes to already exported rows (updated counts, refreshed users,
+# downloaded file paths, resolved comment parents) only show up in a full export. A full export
+# replaces the earlier files of its tables, so the directory can always be read as one dataset.
+# Run with: python -m tiktok_research.tiktok_research_export scrape.sqlite export/ --format parquet
+
+# table -> FROM clause and (column, SQL expression, type) of the exported columns
+EXPORT_TABLES = {
+    'video': {
+        'from': 'video v LEFT JOIN "user" u ON u.id = v.user_id LEFT JOIN region r ON r.id = v.region_id',
+        'id': 'v.id',
+        'columns': [
+            ('id', 'v.id', 'int'),
+            ('item_id', 'v.item_id', 'int'),
+            ('create_time', 'v.create_time', 'time'),
+            ('username', 'u.username', 'str'),
+            ('region_code', 'r.name', 'str'),
+            ('desc', 'v."desc"', 'str'),
+            ('music_id', 'v.music_id', 'int'),
+            ('like_cnt', 'v.like_cnt', 'int'),
+            ('comment_cnt', 'v.comment_cnt', 'int'),
+            ('share_cnt', 'v.share_cnt', 'int'),
+            ('view_cnt', 'v.view_cnt', 'int'),
+            ('voice_to_text', 'v.voice_to_text', 'str'),
+            ('is_stem_verified', 'v.is_stem_verified', 'bool'),
+            ('duration', 'v.duration', 'int'),
+            ('favorites_count', 'v.favorites_count', 'int'),
+            ('path', 'v.path', 'str'),
+            ('label_warn', 'v.label_warn', 'bool'),
+            ('label_content', 'v.label_content', 'str'),
+            ('label_sink', 'v.label_sink', 'bool'),
+            ('label_type', 'v.label_type', 'int'),
+            ('label_vote', 'v.label_vote', 'bool'),
+            ('hashtags', (
+                '(SELECT json_group_array(h.name) FROM hashtagonvideo hv '
+                'JOIN hashtag h ON h.id = hv.hashtag_id WHERE hv.video_id = v.id)'
+            ), 'list'),
+        ],
+    },
+    'comment': {
+        'from': 'comment c LEFT JOIN video v ON v.id = c.video_id LEFT JOIN comment p ON p.id = c.parent_id',
+        'id': 'c.id',
+        'columns': [
+            ('id', 'c.id', 'int'),
+            ('tt_id', 'c.tt_id', 'int'),
+            ('video_id', 'v.item_id', 'int'),
+            ('parent_id', 'p.tt_id', 'int'),
+            ('create_time', 'c.create_time', 'time'),
+            ('like_cnt', 'c.like_cnt', 'int'),
+            ('reply_cnt', 'c.reply_cnt', 'int'),
+            ('text', 'c.text', 'str'),
+        ],
+    },
+    'user': {
+        'from': '"user" u',
+        'id': 'u.id',
+        'columns': [
+            ('id', 'u.id', 'int'),
+            ('username', 'u.username', 'str'),
+            ('displayname', 'u.displayname', 'str'),
+            ('following_cnt', 'u.following_cnt', 'int'),
+            ('follower_cnt', 'u.follower_cnt', 'int'),
+            ('like_cnt', 'u.like_cnt', 'int'),
+            ('video_cnt', 'u.video_cnt', 'int'),
+            ('bio', 'u.bio', 'str'),
+            ('bio_url', 'u.bio_url', 'str'),
+            ('avatar_url', 'u.avatar_url', 'str'),
+            ('avatar_path', 'u.avatar_path', 'str'),
+            ('is_verified', 'u.is_verified', 'bool'),
+            ('updated_at', 'u.updated_at', 'time'),
+        ],
+    },
+    'hashtag': {
+        'from': 'hashtag h',
+        'id': 'h.id',
+        'columns': [
+            ('id', 'h.id', 'int'),
+            ('tt_id', 'h.tt_id', 'int'),
+            ('name', 'h.name', 'str'),
+            ('desc', 'h."desc"', 'str'),
+        ],
+    },
+    'region': {
+        'from': 'region r',
+        'id': 'r.id',
+        'columns': [
+            ('id', 'r.id', 'int'),
+            ('name', 'r.name', 'str'),
+            ('desc', 'r."desc"', 'str'),
+        ],
+    },
+}
+
+EXTENSIONS = {
+    'parquet': 'parquet',
+    'arrow': 'arrow',
+    'jsonl': 'jsonl',
+}
+
+def to_bool(value):
+    return None if value == None else bool(value)
+
+def to_time(value):
+    return None if value == None else datetime.fromisoformat(value)
+
+def to_list(value):
+    return [] if value == None else json.loads(value)
+
+CONVERTERS = {
+    'bool': to_bool,
+    'time': to_time,
+    'list': to_list,
+}
+
+# JSON keeps the timestamps as the stored ISO strings
+JSON_CONVERTERS = {
+    'bool': to_bool,
+    'list': to_list,
+}
+
+def arrow_type(kind:str):
+    return {
+        'int': pyarrow.int64(),
+        'str': pyarrow.string(),
+        'bool': pyarrow.bool_(),
+        'time': pyarrow.timestamp('us'),
+        'list': pyarrow.list_(pyarrow.string()),
+    }[kind]
+
+class ArrowFileWriter():
+    def __init__(self, path:str, columns:list, format:str, compression:str):
+        self.schema = pyarrow.schema([(name, arrow_type(kind)) for name, _, kind in columns])
+        self.columns = columns
+        if format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression or 'none')
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+            self.writer = pyarrow.ipc.new_file(path, self.schema, options=options)
+
+    def write(self, rows:list):
+        values = list(zip(*rows))
+        arrays = []
+        for i, (_, _, kind) in enumerate(self.columns):
+            convert = CONVERTERS.get(kind, None)
+            column = values[i] if convert == None else [convert(v) for v in values[i]]
+            arrays.append(pyarrow.array(column, type=self.schema.field(i).type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+class JsonlFileWriter():
+    def __init__(self, path:str, columns:list, compression:str):
+        self.names = [name for name, _, _ in columns]
+        self.converters = [JSON_CONVERTERS.get(kind, None) for _, _, kind in columns]
+        if compression == 'zstd':
+            self.file = zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'))
+        elif compression == 'gzip':
+            self.file = gzip.open(path, 'wb')
+        else:
+            self.file = open(path, 'wb')
+
+    def write(self, rows:list):
+        lines = []
+        for row in rows:
+            record = {
+                name: value if convert == None else convert(value)
+                for name, value, convert in zip(self.names, row, self.converters)
+            }
+            lines.append(json.dumps(record, ensure_ascii=False))
+        self.file.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def close(self):
+        self.file.close()
+
+class DbExporter():
+    def __init__(self, database, out_dir:str, format:str = 'parquet', compression:str = 'zstd', chunk_size:int = 50000, log=print):
+        if format not in EXTENSIONS:
+            raise ValueError(f"format must be one of {', '.join(EXTENSIONS)}")
+        if (format in ('parquet', 'arrow')) and (pyarrow == None):
+            raise ImportError(f"{format} export needs pyarrow: pip install pyarrow")
+        if (format == 'jsonl') and (compression == 'zstd') and (zstandard == None):
+            raise ImportError("zstd compressed jsonl export needs zstandard: pip install zstandard")
+        self.database = database
+        self.out_dir = out_dir
+        self.format = format
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.log = log
+        self.state_path = os.path.join(out_dir, 'export_state.json')
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def save_state(self, state:dict):
+        tmp_path = self.state_path + '.part'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def file_name(self, table:str, first_id:int, last_id:int):
+        name = f"{table}_{first_id}-{last_id}.{EXTENSIONS[self.format]}"
+        if (self.format == 'jsonl') and (self.compression == 'zstd'):
+            name += '.zst'
+        elif (self.format == 'jsonl') and (self.compression == 'gzip'):
+            name += '.gz'
+        return name
+
+    def open_writer(self, path:str, columns:list):
+        if self.format == 'jsonl':
+            return JsonlFileWriter(path, columns, self.compression)
+        return ArrowFileWriter(path, columns, self.format, self.compression)
+
+    def export_table(self, table:str, since_id:int = 0):
+        # writes the rows with since_id < id <= max(id) at the time of the call, rows with a lower
+        # id are skipped even if they changed. Returns (rows, last exported id, file path)
+        spec = EXPORT_TABLES[table]
+        id_column = spec['id']
+        first_id, last_id = self.database.execute_sql(
+            f'SELECT min(id), max(id) FROM "{table}" WHERE id > ?',
+            (since_id,)
+        ).fetchone()
+        if last_id == None:
+            return 0, since_id, None
+
+        columns = spec['columns']
+        sql = (
+            f"SELECT {', '.join(expr for _, expr, _ in columns)} FROM {spec['from']} "
+            f"WHERE {id_column} > ? AND {id_column} <= ? ORDER BY {id_column}"
+        )
+        path = os.path.join(self.out_dir, self.file_name(table, first_id, last_id))
+        writer = self.open_writer(path + '.part', columns)
+        rows = 0
+        try:
+            cursor = self.database.execute_sql(sql, (since_id, last_id))
+            while True:
+                chunk = cursor.fetchmany(self.chunk_size)
+                if len(chunk) == 0:
+                    break
+                writer.write(chunk)
+                rows += len(chunk)
+        finally:
+            writer.close()
+        os.replace(path + '.part', path)
+        return rows, last_id, path
+
+    def remove_chunks(self, table:str, keep:str = None):
+        # deletes the files of earlier exports of the table, in any format
+        pattern = re.compile(re.escape(table) + r'_\d+-\d+\.')
+        for name in os.listdir(self.out_dir):
+            path = os.path.join(self.out_dir, name)
+            if pattern.match(name) and (path != keep) and not name.endswith('.part'):
+                os.remove(path)
+
+    def export(self, tables:list[str] = None, incremental:bool = True):
+        os.makedirs(self.out_dir, exist_ok=True)
+        state = self.load_state() if incremental else {}
+        counts = {}
+        for table in tables or list(EXPORT_TABLES):
+            rows, last_id, path = self.export_table(table, state.get(table, 0))
+            counts[table] = rows
+            if not incremental:
+                self.remove_chunks(table, keep=path)
+            if path != None:
+                self.log("exported", rows, table, "rows to", path)
+                state[table] = last_id
+                self.save_state(state)
+        return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a TikTokResearchDb sqlite file')
+    parser.add_argument('db_path')
+    parser.add_argument('out_dir')
+    parser.add_argument('--format', choices=list(EXTENSIONS), default='parquet')
+    parser.add_argument('--compression', default='zstd', help='zstd, gzip (jsonl only) or none')
+    parser.add_argument('--tables', nargs='+', choices=list(EXPORT_TABLES), default=None)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--full', action='store_true', help='export all rows instead of the ones added since the last export, includes changes to already exported rows')
+    args = parser.parse_args()
+    database = SqliteDatabase(args.db_path, pragmas={'query_only': 1})
+    exporter = DbExporter(
+        database,
+        args.out_dir,
+        format=args.format,
+        compression=None if args.compression == 'none' else args.compression,
+        chunk_size=args.chunk_size
+    )
+    exporter.export(tables=args.tables, incremental=not args.full)
+    database.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from .tiktok_research_enums import ApiNodes
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+
+class FakeResearchApi():
+    # Local stand-in for the Research API. Every ApiNodes endpoint answers with deterministic
+    # data, pagination follows the cursor/has_more/search_id rules of the real API and
+    # latency, 5xx, 429 and "search_id expired" faults can be injected.
+    def __init__(
+        self,
+        host:str = '127.0.0.1',
+        port:int = 0,
+        videos_per_day:int = 200,
+        comments_per_video:int = 20,
+        users:int = 1000,
+        followers_per_user:int = 50,
+        latency:float = 0,
+        error_rate:float = 0,
+        rate_limit_rate:float = 0,
+        daily_quota:int = None,
+        expire_rate:float = 0,
+        token_ttl:int = 7200,
+        max_query_values:int = 100,
+        seed:int = 0
+    ):
+        self.host = host
+        self.port = port
+        self.videos_per_day = videos_per_day
+        self.comments_per_video = comments_per_video
+        self.users = users
+        self.followers_per_user = followers_per_user
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # requests per client_key until the "per day" 429 of a used up quota is returned
+        self.daily_quota = daily_quota
+        self.expire_rate = expire_rate
+        self.token_ttl = token_ttl
+        self.max_query_values = max_query_values
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.searches = {}
+        self.requests = Counter()
+        # requests per client_key of the token that was sent
+        self.client_requests = Counter()
+        self.responses = Counter()
+        self.bytes_sent = 0
+        self.server = None
+        self.thread = None
+        self.routes = {
+            ApiNodes.video.value: self.video_query,
+            ApiNodes.comments.value: self.comments,
+            ApiNodes.userinfo.value: self.user_info,
+            ApiNodes.userlikes.value: lambda body: self.user_videos(body, 'user_liked_videos'),
+            ApiNodes.userpins.value: self.user_pinned_videos,
+            ApiNodes.userfollowers.value: lambda body: self.user_graph(body, 'user_followers'),
+            ApiNodes.userfollowing.value: lambda body: self.user_graph(body, 'user_following'),
+            ApiNodes.userreposts.value: lambda body: self.user_videos(body, 'user_reposted_videos'),
+            ApiNodes.playlist.value: self.playlist,
+        }
+
+    @property
+    def base_address(self):
+        return f'http://{self.host}:{self.port}/v2/'
+
+    def start(self):
+        api = self
+        class Handler(FakeResearchHandler):
+            fake_api = api
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_address
+
+    def stop(self):
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+            self.client_requests.clear()
+            self.responses.clear()
+            self.bytes_sent = 0
+
+    def chance(self, rate:float):
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    # responses are (status, body)
+    def ok(self, data):
+        return 200, {'data': data, 'error': {'code': 'ok', 'message': '', 'log_id': uuid.uuid4().hex}}
+
+    def error(self, status:int, code:str, message:str):
+        return status, {'data': {}, 'error': {'code': code, 'message': message, 'log_id': uuid.uuid4().hex}}
+
+    def token(self, form):
+        token = 'fake.' + uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = (time.time() + self.token_ttl, form.get('client_key', ''))
+        return 200, {'access_token': token, 'token_type': 'Bearer', 'expires_in': self.token_ttl}
+
+    def check_token(self, authorization:str):
+        token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+        with self.lock:
+            expire_ts, client_key = self.tokens.get(token, (0, None))
+            if expire_ts <= time.time():
+                return None
+            self.client_requests[client_key] += 1
+        return client_key
+
+    def handle(self, path:str, authorization:str, body):
+        node = path[len('/v2/'):] if path.startswith('/v2/') else path
+        with self.lock:
+            self.requests[node] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if node == ApiNodes.token.value:
+            return self.token(body)
+        if node not in self.routes:
+            return self.error(404, 'not_found', f'unknown endpoint {node}')
+        client_key = self.check_token(authorization)
+        if client_key == None:
+            return self.error(401, 'access_token_invalid', 'The access token is invalid or not found in the request.')
+        if (self.daily_quota != None) and (self.client_requests[client_key] > self.daily_quota):
+            return self.error(429, 'rate_limit_exceeded', f'API rate limit was exceeded, only {self.daily_quota} requests are allowed per day.')
+        if self.chance(self.rate_limit_rate):
+            return self.error(429, 'rate_limit_exceeded', 'API rate limit was exceeded, please try again later.')
+        if self.chance(self.error_rate):
+            return self.error(500, 'internal_error', 'Something went wrong. Please try again later.')
+        return self.routes[node](body)
+
+    def paginate(self, body, total:int, make_item, item_name:str, max_page:int = 100):
+        cursor = int(body.get('cursor', 0) or 0)
+        max_count = min(int(body.get('max_count', 20) or 20), max_page)
+        items = [make_item(k) for k in range(cursor, min(cursor + max_count, total))]
+        return {
+            item_name: items,
+            'cursor': cursor + len(items),
+            'has_more': cursor + len(items) < total
+        }
+
+    def query_values(self, query, field_name:str):
+        for condition in (query or {}).get('and', []):
+            if condition.get('field_name') == field_name:
+                return condition.get('field_values', [])
+        return []
+
+    def make_video(self, query, day:datetime, index:int):
+        video_id = day.toordinal() * 1000000 + index
+        rnd = random.Random(video_id)
+        usernames = self.query_values(query, 'username') or [f'user{rnd.randrange(self.users)}']
+        hashtags = self.query_values(query, 'hashtag_name') or ['fyp']
+        music_ids = self.query_values(query, 'music_id') or [rnd.randrange(10 ** 12)]
+        regions = self.query_values(query, 'region_code') or ['DE']
+        hashtag_names = [rnd.choice(hashtags), f'tag{rnd.randrange(500)}']
+        return {
+            'id': video_id,
+            'create_time': int((day + timedelta(seconds=index * 86400 // max(self.videos_per_day, 1))).timestamp()),
+            'username': rnd.choice(usernames),
+            'region_code': rnd.choice(regions),
+            'video_description': f'fake video {video_id} #' + ' #'.join(hashtag_names),
+            'music_id': int(rnd.choice(music_ids)),
+            'like_count': rnd.randrange(100000),
+            'comment_count': self.comments_per_video,
+            'share_count': rnd.randrange(1000),
+            'view_count': rnd.randrange(1000000),
+            'hashtag_names': hashtag_names,
+            'hashtag_info_list': [
+                {'hashtag_id': zlib.crc32(name.encode('utf-8')), 'hashtag_name': name, 'hashtag_description': ''}
+                for name in hashtag_names
+            ],
+            'is_stem_verified': False,
+            'video_duration': rnd.randrange(5, 180),
+            'video_mention_list': [],
+            'video_label': {},
+            'effect_ids': [],
+            'playlist_id': 0,
+            'voice_to_text': 'fake transcript ' * rnd.randrange(1, 20),
+        }
+
+    def video_query(self, body):
+        for condition in (body.get('query') or {}).get('and', []):
+            if len(condition.get('field_values', [])) > self.max_query_values:
+                return self.error(400, 'invalid_params', f"Too many values for {condition.get('field_name')}")
+        search_id = body.get('search_id', '') or ''
+        if search_id != '':
+            with self.lock:
+                known = search_id in self.searches
+            if (not known) or self.chance(self.expire_rate):
+                return self.error(400, 'invalid_params', f'Search Id {search_id} is invalid or expired')
+        else:
+            search_id = uuid.uuid4().hex
+            with self.lock:
+                self.searches[search_id] = True
+        start_date = datetime.strptime(body['start_date'], '%Y%m%d')
+        end_date = datetime.strptime(body['end_date'], '%Y%m%d')
+        days = max((end_date - start_date).days, 1)
+        data = self.paginate(
+            body,
+            days * self.videos_per_day,
+            lambda k: self.make_video(body.get('query'), start_date + timedelta(days=k // self.videos_per_day), k % self.videos_per_day),
+            'videos'
+        )
+        data['search_id'] = search_id
+        return self.ok(data)
+
+    def comments(self, body):
+        video_id = int(body['video_id'])
+        def make_comment(k):
+            comment_id = video_id * 1000 + k
+            parent_id = video_id if k % 4 == 0 else comment_id - 1 #every 4th comment starts a thread
+            return {
+                'id': comment_id,
+                'video_id': video_id,
+                'text': f'fake comment {k} on {video_id}',
+                'like_count': k,
+                'reply_count': 1 if k % 4 == 0 else 0,
+                'parent_comment_id': parent_id,
+                'create_time': 1700000000 + k,
+            }
+        return self.ok(self.paginate(body, self.comments_per_video, make_comment, 'comments'))
+
+    def user_info(self, body):
+        username = body['username']
+        rnd = random.Random(username)
+        return self.ok({
+            'display_name': username.capitalize(),
+            'bio_description': f'bio of {username}',
+            'avatar_url': f'http://{self.host}:{self.port}/avatar/{username}.jpg',
+            'is_verified': rnd.random() < 0.05,
+            'follower_count': rnd.randrange(10 ** 6),
+            'following_count': rnd.randrange(1000),
+            'likes_count': rnd.randrange(10 ** 7),
+            'video_count': rnd.randrange(1000),
+            'bio_url': '',
+        })
+
+    def user_graph(self, body, item_name:str):
+        username = body['username']
+        rnd = random.Random(username + item_name)
+        others = [f'user{rnd.randrange(self.users)}' for _ in range(self.followers_per_user)]
+        return self.ok(self.paginate(
+            body,
+            len(others),
+            lambda k: {'display_name': others[k].capitalize(), 'username': others[k]},
+            item_name
+        ))
+
+    def user_videos(self, body, item_name:str):
+        username = body['username']
+        day = datetime(2024, 1, 1)
+        return self.ok(self.paginate(
+            body,
+            self.videos_per_day,
+            lambda k: self.make_video({'and': [{'field_name': 'username', 'field_values': [username]}]}, day, k),
+            item_name
+        ))
+
+    def user_pinned_videos(self, body):
+        username = body['username']
+        day = datetime(2024, 1, 1)
+        query = {'and': [{'field_name': 'username', 'field_values': [username]}]}
+        return self.ok({'pinned_videos_list': [self.make_video(query, day, k) for k in range(3)]})
+
+    def playlist(self, body):
+        playlist_id = int(body['playlist_id'])
+        return self.ok({
+            'playlist_id': playlist_id,
+            'playlist_name': f'playlist {playlist_id}',
+            'playlist_video_ids': [playlist_id * 10 + k for k in range(10)],
+            'playlist_item_total': 10,
+        })
+
+class FakeResearchHandler(BaseHTTPRequestHandler):
+    fake_api = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        raw = self.rfile.read(length) if length > 0 else b''
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            return {k: v[0] for k, v in parse_qs(raw.decode('utf-8')).items()}
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+
+    def send_json(self, status:int, body):
+        raw = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+        with self.fake_api.lock:
+            self.fake_api.responses[status] += 1
+            self.fake_api.bytes_sent += len(raw)
+
+    def do_POST(self):
+        body = self.read_body()
+        status, res = self.fake_api.handle(
+            urlparse(self.path).path,
+            self.headers.get('Authorization', ''),
+            body
+        )
+        self.send_json(status, res)
+
+    def do_GET(self):
+        # avatars and video files
+        raw = b'\0' * 1024
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+def main():
+    parser = argparse.ArgumentParser(description='Local fake TikTok Research API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--videos-per-day', type=int, default=200)
+    parser.add_argument('--comments-per-video', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0)
+    parser.add_argument('--daily-quota', type=int, default=None)
+    parser.add_argument('--expire-rate', type=float, default=0)
+    args = parser.parse_args()
+    api = FakeResearchApi(
+        host=args.host,
+        port=args.port,
+        videos_per_day=args.videos_per_day,
+        comments_per_video=args.comments_per_video,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        daily_quota=args.daily_quota,
+        expire_rate=args.expire_rate
+    )
+    print('serving fake Research API on', api.start())
+    try:
+        api.thread.join()
+    except KeyboardInterrupt:
+        api.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from .tiktok_research_enums import ApiNodes
+import random
+import threading
+import time
+
+class QuotaExceeded(Exception):
+    pass
+
+class RateLimiter():
+    # Counts requests per endpoint against a daily budget (reset at 00:00 UTC, like the
+    # Research API quota) and a budget per sliding window of window_seconds.
+    # Limits are dicts ApiNodes -> number of requests, endpoints without an entry are unlimited.
+    def __init__(
+        self,
+        daily_limits:dict = None,
+        window_limits:dict = None,
+        window_seconds:int = 60,
+        max_retries:int = 5,
+        backoff_base:float = 2,
+        backoff_max:float = 120
+    ):
+        self.daily_limits = daily_limits or {}
+        self.window_limits = window_limits or {}
+        self.window_seconds = window_seconds
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.day = self.today()
+        self.daily_counts = defaultdict(int)
+        self.window_calls = defaultdict(deque)
+        self.exhausted = set()
+
+    def today(self):
+        return datetime.now(timezone.utc).date()
+
+    def reset_day(self):
+        day = self.today()
+        if day != self.day:
+            self.day = day
+            self.daily_counts.clear()
+            self.exhausted.clear()
+
+    def try_acquire(self, node:ApiNodes):
+        # counts the request and returns 0 if it may be sent now, otherwise returns the seconds
+        # until the window budget allows it; raises QuotaExceeded when the daily budget is used up
+        with self.lock:
+            self.reset_day()
+            if (node in self.exhausted) or (self.daily_counts[node] >= self.daily_limits.get(node, float('inf'))):
+                raise QuotaExceeded(f"daily quota for {node.value} used up ({self.daily_counts[node]} requests)")
+            now = time.monotonic()
+            calls = self.window_calls[node]
+            while calls and (calls[0] <= now - self.window_seconds):
+                calls.popleft()
+            if len(calls) < self.window_limits.get(node, float('inf')):
+                calls.append(now)
+                self.daily_counts[node] += 1
+                return 0
+            return max(calls[0] + self.window_seconds - now, 0.001)
+
+    def acquire(self, node:ApiNodes):
+        # blocks until the window budget allows one more request
+        while True:
+            wait = self.try_acquire(node)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def clone(self):
+        # same limits, separate counts (e.g. for another client key)
+        return RateLimiter(
+            daily_limits=dict(self.daily_limits),
+            window_limits=dict(self.window_limits),
+            window_seconds=self.window_seconds,
+            max_retries=self.max_retries,
+            backoff_base=self.backoff_base,
+            backoff_max=self.backoff_max
+        )
+
+    def exhaust(self, node:ApiNodes):
+        # the API reported the daily quota as used up
+        with self.lock:
+            self.exhausted.add(node)
+
+    def remaining(self, node:ApiNodes):
+        # remaining daily requests, None for unlimited endpoints
+        with self.lock:
+            self.reset_day()
+            if node in self.exhausted:
+                return 0
+            if node not in self.daily_limits:
+                return None
+            return max(self.daily_limits[node] - self.daily_counts[node], 0)
+
+    def used(self, node:ApiNodes):
+        with self.lock:
+            self.reset_day()
+            return self.daily_counts[node]
+
+    def backoff(self, attempt:int, retry_after = None):
+        # exponential backoff with full jitter, a Retry-After header wins if present
+        delay = None
+        if retry_after != None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+        if delay == None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        time.sleep(delay)
@@ -0,0 +1,158 @@
+from peewee import SqliteDatabase
+from .peewee_db_model import *
+import argparse
+import os
+
+# Merges TikTokResearchDb sqlite files into one with set-based SQL: every source is attached in
+# turn and each table is copied with one INSERT ... SELECT ... ON CONFLICT statement. Rows are
+# matched on their natural keys, foreign keys are remapped through the natural keys of the
+# referenced rows and a row that already exists is completed with the values it is missing.
+# Engagement counts and user info come from the newer row: the one with the later updated_at
+# for users, the one with more views (videos) or likes and replies (comments), as counts only grow.
+# Run with: python -m tiktok_research.tiktok_research_merge merged.sqlite a.sqlite b.sqlite ...
+
+# foreign key column -> (referenced table, natural key of the referenced table)
+USER_REF = ('user', 'username')
+VIDEO_REF = ('video', 'item_id')
+
+# table, model, natural key, foreign keys, which row is newer (None: only fill missing values),
+# custom update clause
+MERGE_TABLES = [
+    ('region', Region, ('name',), {}, None, None),
+    ('user', User, ('username',), {}, 'excluded."updated_at" > coalesce("user"."updated_at", \'\')', None),
+    ('hashtag', Hashtag, ('name',), {}, None, None),
+    ('video', Video, ('item_id',), {'user_id': USER_REF, 'region_id': ('region', 'name')},
+        'coalesce(excluded."view_cnt", -1) > coalesce("video"."view_cnt", -1)', None),
+    ('hashtagonvideo', HashtagOnVideo, ('hashtag_id', 'video_id'), {'hashtag_id': ('hashtag', 'name'), 'video_id': VIDEO_REF},
+        None, None),
+    ('comment', Comment, ('tt_id',), {'video_id': VIDEO_REF},
+        '(coalesce(excluded."like_cnt", -1), coalesce(excluded."reply_cnt", -1)) > '
+        '(coalesce("comment"."like_cnt", -1), coalesce("comment"."reply_cnt", -1))', None),
+    ('useronuser', UserOnUser, ('following_id', 'follower_id'), {'following_id': USER_REF, 'follower_id': USER_REF},
+        None, None),
+    ('crawlfrontier', CrawlFrontier, ('crawl', 'username'), {}, None,
+        '"done" = max("done", excluded."done"), "depth" = min("depth", excluded."depth")'),
+    ('scrapecheckpoint', ScrapeCheckpoint, ('query_key', 'start_date'), {}, None,
+        '"cursor" = excluded."cursor", "search_id" = excluded."search_id", "done" = excluded."done" '
+        'WHERE excluded."done" AND NOT "done"'),
+]
+
+# columns that are set after the insert, Comment.parent refers to rows of the same table
+DEFERRED_COLUMNS = {'comment': ('parent_id',)}
+
+def quoted(columns):
+    return ', '.join(f'"{c}"' for c in columns)
+
+class DbMerger():
+    def __init__(self, db_path:str, log=print):
+        self.db_path = db_path
+        self.log = log
+        self.database = SqliteDatabase(db_path, pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -256 * 1024,
+            'temp_store': 'memory',
+        })
+        self.models = [model for _, model, _, _, _, _ in MERGE_TABLES]
+
+    def source_columns(self, table:str):
+        # columns of the table in the attached source, empty if the source has no such table
+        return {row[1] for row in self.database.execute_sql(f'PRAGMA src.table_info("{table}")').fetchall()}
+
+    def merge_sql(self, table:str, model, key:tuple, refs:dict, newer:str, update:str, columns:set):
+        fields = [
+            f.column_name for f in model._meta.sorted_fields
+            if (f.column_name in columns) and (f.column_name not in DEFERRED_COLUMNS.get(table, ()))
+            and not (f.primary_key and (f.column_name == 'id'))
+        ]
+        selects = []
+        joins = []
+        for column in fields:
+            if column not in refs:
+                selects.append(f't."{column}"')
+                continue
+            ref_table, ref_key = refs[column]
+            # a required reference that cannot be resolved drops the row instead of failing the insert
+            join = 'LEFT JOIN' if model._meta.columns[column].null else 'JOIN'
+            joins.append(
+                f'{join} src."{ref_table}" s_{column} ON s_{column}.id = t."{column}" '
+                f'{join} main."{ref_table}" m_{column} ON m_{column}."{ref_key}" = s_{column}."{ref_key}"'
+            )
+            selects.append(f'm_{column}.id')
+        others = [c for c in fields if c not in key]
+        if update == None:
+            if newer == None:
+                update = ', '.join(f'"{c}" = coalesce("{table}"."{c}", excluded."{c}")' for c in others)
+            else:
+                update = ', '.join(
+                    f'"{c}" = CASE WHEN {newer} THEN coalesce(excluded."{c}", "{table}"."{c}") '
+                    f'ELSE coalesce("{table}"."{c}", excluded."{c}") END'
+                    for c in others
+                )
+        conflict = 'DO NOTHING' if (update == '') else f'DO UPDATE SET {update}'
+        return (
+            f'INSERT INTO main."{table}" ({quoted(fields)}) '
+            f'SELECT {", ".join(selects)} FROM src."{table}" t {" ".join(joins)} WHERE true '
+            f'ON CONFLICT ({quoted(key)}) {conflict}'
+        )
+
+    def comment_parents_sql(self):
+        # replies whose parent has no parent set yet, matched through the tt_ids of the source.
+        # A correlated subquery instead of UPDATE ... FROM, which needs sqlite 3.33
+        parents = (
+            'SELECT c."tt_id" AS tt_id, mp.id AS parent_id FROM src."comment" c '
+            'JOIN src."comment" p ON p.id = c."parent_id" '
+            'JOIN main."comment" mp ON mp."tt_id" = p."tt_id"'
+        )
+        return (
+            f'UPDATE main."comment" SET "parent_id" = (SELECT m.parent_id FROM ({parents}) m WHERE m.tt_id = "comment"."tt_id") '
+            f'WHERE "parent_id" IS NULL AND "tt_id" IN (SELECT tt_id FROM ({parents}))'
+        )
+
+    def merge_source(self, path:str):
+        # merges one db file, returns table -> rows inserted or updated
+        counts = {}
+        self.database.execute_sql('ATTACH DATABASE ? AS src', (path,))
+        try:
+            with self.database.atomic():
+                for table, model, key, refs, newer, update in MERGE_TABLES:
+                    columns = self.source_columns(table)
+                    if len(columns) == 0:
+                        continue
+                    cursor = self.database.execute_sql(self.merge_sql(table, model, key, refs, newer, update, columns))
+                    counts[table] = cursor.rowcount
+                    if (table == 'comment') and ('parent_id' in columns):
+                        self.database.execute_sql(self.comment_parents_sql())
+        finally:
+            self.database.execute_sql('DETACH DATABASE src')
+        return counts
+
+    def merge(self, source_paths:list[str]):
+        # merges the files one after another into db_path, returns path -> table -> rows
+        results = {}
+        with self.database.bind_ctx(self.models):
+            self.database.create_tables(self.models)
+            for path in source_paths:
+                if os.path.abspath(path) == os.path.abspath(self.db_path):
+                    continue
+                if not os.path.exists(path):
+                    self.log("merge: no such file", path)
+                    continue
+                results[path] = self.merge_source(path)
+                self.log("merged", path, results[path])
+            self.database.execute_sql('ANALYZE')
+        self.database.close()
+        return results
+
+def merge_databases(db_path:str, source_paths:list[str], log=print):
+    return DbMerger(db_path, log=log).merge(source_paths)
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge TikTokResearchDb sqlite files into one')
+    parser.add_argument('db_path', help='merged db, created if it does not exist')
+    parser.add_argument('sources', nargs='+')
+    args = parser.parse_args()
+    merge_databases(args.db_path, args.sources)
+
+if __name__ == '__main__':
+    main()
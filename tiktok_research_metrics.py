@@ -0,0 +1,235 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+# request latencies and db write times in seconds, sizes are counted in the same buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8)
+
+class Histogram():
+    def __init__(self, buckets:tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Timer():
+    def __init__(self, metrics, name:str, labels:dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.started
+        self.metrics.observe(self.name, self.seconds, **self.labels)
+
+class Metrics():
+    # Thread-safe counters and histograms keyed by name and labels, e.g.
+    # metrics.inc('api_requests_total', node='video', status=200).
+    # Every update and event is also handed to the sinks (LoggingSink, CallbackSink, ...),
+    # PrometheusExporter reads the current values instead.
+    def __init__(self, sinks:list = None):
+        self.sinks = list(sinks or [])
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def emit(self, event:dict):
+        for sink in self.sinks:
+            try:
+                sink.handle(event)
+            except Exception as e:
+                logging.getLogger('tiktok_research').warning("metrics sink failed: %s", e)
+
+    def inc(self, name:str, value:float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+        if self.sinks:
+            self.emit({'type': 'counter', 'name': name, 'value': value, 'labels': labels})
+
+    def observe(self, name:str, value:float, buckets:tuple = DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key, None)
+            if histogram == None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+        if self.sinks:
+            self.emit({'type': 'histogram', 'name': name, 'value': value, 'labels': labels})
+
+    def timer(self, name:str, **labels):
+        return Timer(self, name, labels)
+
+    def event(self, name:str, **fields):
+        # one trace record, e.g. a finished date window, only seen by the sinks
+        if self.sinks:
+            self.emit({'type': 'event', 'name': name, 'fields': fields, 'ts': time.time()})
+
+    def counter(self, name:str, **labels):
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name:str, **labels):
+        with self.lock:
+            return self.histograms.get((name, tuple(sorted(labels.items()))), None)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'count': h.count,
+                        'sum': h.sum,
+                        'buckets': dict(zip(list(h.buckets) + ['+Inf'], h.counts)),
+                    }
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+class LoggingSink():
+    # one JSON line per update/event on a standard logger
+    def __init__(self, logger:logging.Logger = None, level:int = logging.INFO, types:tuple = ('counter', 'histogram', 'event')):
+        self.logger = logger or logging.getLogger('tiktok_research')
+        self.level = level
+        self.types = types
+
+    def handle(self, event:dict):
+        if event['type'] in self.types:
+            self.logger.log(self.level, json.dumps(event, default=str))
+
+class CallbackSink():
+    def __init__(self, callback):
+        self.callback = callback
+
+    def handle(self, event:dict):
+        self.callback(event)
+
+def prometheus_labels(labels, extra:dict = None):
+    items = list(labels) + list((extra or {}).items())
+    if len(items) == 0:
+        return ''
+    return '{' + ','.join(
+        f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for k, v in items
+    ) + '}'
+
+def render_prometheus(metrics:Metrics, prefix:str = 'tiktok_research_'):
+    # the text exposition format of Prometheus
+    lines = []
+    with metrics.lock:
+        counters = sorted(metrics.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        histograms = sorted(metrics.histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        histograms = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in histograms]
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f'# TYPE {prefix}{name} counter')
+            typed.add(name)
+        lines.append(f'{prefix}{name}{prometheus_labels(labels)} {value}')
+    for (name, labels), buckets, counts, total, count in histograms:
+        if name not in typed:
+            lines.append(f'# TYPE {prefix}{name} histogram')
+            typed.add(name)
+        cumulative = 0
+        for le, bucket_count in zip(buckets + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append(f'{prefix}{name}_bucket{prometheus_labels(labels, {"le": le})} {cumulative}')
+        lines.append(f'{prefix}{name}_sum{prometheus_labels(labels)} {total}')
+        lines.append(f'{prefix}{name}_count{prometheus_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+class PrometheusExporter():
+    # Serves the metrics on http://host:port/metrics and/or writes them to a textfile for the
+    # node_exporter textfile collector. The textfile is rewritten every interval seconds.
+    def __init__(self, metrics:Metrics, prefix:str = 'tiktok_research_'):
+        self.metrics = metrics
+        self.prefix = prefix
+        self.server = None
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def render(self):
+        return render_prometheus(self.metrics, self.prefix)
+
+    def write_textfile(self, path:str):
+        tmp_path = path + '.part'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_textfile(self, path:str, interval:float = 15):
+        def run():
+            while not self.stopped.wait(interval):
+                self.write_textfile(path)
+            self.write_textfile(path)
+        thread = threading.Thread(target=run, name='PrometheusTextfile', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return self
+
+    def start_http(self, port:int = 9464, host:str = '0.0.0.0'):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name='PrometheusHttp', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return self
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.stopped.set()
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
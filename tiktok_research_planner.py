@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+class WindowPlanner():
+    # Splits [start_date, end_date) into query windows. With adaptive=True the window
+    # size follows the result density: sparse windows make the next one bigger, windows
+    # that need many pages make the next one smaller. Windows a checkpoint marks as done
+    # are skipped. The feedback only sizes the windows planned after it arrives: a dense
+    # window is fetched to its end and not split, and with several workers the windows
+    # already handed out keep their size.
+    def __init__(
+        self,
+        start_date:datetime,
+        end_date:datetime,
+        time_delta:timedelta,
+        adaptive:bool = False,
+        min_time_delta:timedelta = timedelta(days=1),
+        max_time_delta:timedelta = timedelta(days=30),
+        sparse_pages:int = 1,
+        dense_pages:int = 10,
+        checkpoint = None
+    ):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.time_delta = time_delta
+        self.adaptive = adaptive
+        self.min_time_delta = min_time_delta
+        self.max_time_delta = max_time_delta
+        self.sparse_pages = sparse_pages
+        self.dense_pages = dense_pages
+        self.checkpoint = checkpoint
+        self.next_start = start_date
+
+    def next_window(self):
+        if self.checkpoint != None:
+            self.next_start = self.checkpoint.skip_done(self.next_start)
+        if self.next_start >= self.end_date:
+            return None
+        window_end = self.next_start + self.time_delta
+        if self.checkpoint != None:
+            # keep the bounds of an interrupted window and don't overlap finished ones
+            window_end = self.checkpoint.in_flight_end(self.next_start) or window_end
+            window_end = min(window_end, self.checkpoint.next_done_start(self.next_start) or window_end)
+        if window_end > self.end_date:
+            window_end = self.end_date
+        window = (self.next_start, window_end)
+        self.next_start = window_end
+        return window
+
+    def __iter__(self):
+        window = self.next_window()
+        while window != None:
+            yield window
+            window = self.next_window()
+
+    def record(self, start_date:datetime, end_date:datetime, pages:int, items:int):
+        if not self.adaptive:
+            return
+        if pages > self.dense_pages:
+            # whole days only, the API takes dates as YYYYMMDD
+            days = max(self.time_delta.days // 2, self.min_time_delta.days)
+            self.time_delta = timedelta(days=days)
+        elif (pages <= self.sparse_pages) and (end_date - start_date >= self.time_delta):
+            days = min(self.time_delta.days * 2, self.max_time_delta.days)
+            self.time_delta = timedelta(days=days)
@@ -0,0 +1,151 @@
+from datetime import datetime
+from .peewee_db_model import *
+
+class TikTokResearchQueries():
+    # Aggregations over the scrape db, computed by SQLite with GROUP BY instead of iterating
+    # model objects. Every method returns a list of dicts. Filters that are None are not applied,
+    # start_date is inclusive and end_date exclusive.
+    top_orders = {
+        'videos': fn.COUNT(Video.id),
+        'views': fn.SUM(Video.view_cnt),
+        'likes': fn.SUM(Video.like_cnt),
+        'comments': fn.SUM(Video.comment_cnt),
+        'shares': fn.SUM(Video.share_cnt),
+    }
+
+    def filter_videos(self, query, start_date:datetime = None, end_date:datetime = None, region_codes:list[str] = None):
+        if start_date != None:
+            query = query.where(Video.create_time >= start_date)
+        if end_date != None:
+            query = query.where(Video.create_time < end_date)
+        if region_codes != None:
+            query = query.where(Video.region.in_(
+                Region.select(Region.id).where(Region.name.in_(region_codes))
+            ))
+        return query
+
+    def top_order(self, order_by:str):
+        if order_by not in self.top_orders:
+            raise ValueError(f"order_by must be one of {', '.join(self.top_orders)}")
+        return self.top_orders[order_by]
+
+    def sql_query(self, sql:str, params:tuple = ()):
+        cursor = self.db.execute_sql(sql, params)
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def videos_per_day(self, start_date:datetime = None, end_date:datetime = None, region_codes:list[str] = None):
+        day = fn.date(Video.create_time).coerce(False)
+        query = Video.select(
+            day.alias('day'),
+            fn.COUNT(Video.id).alias('videos'),
+            fn.SUM(Video.view_cnt).alias('views'),
+            fn.SUM(Video.like_cnt).alias('likes'),
+        )
+        query = self.filter_videos(query, start_date, end_date, region_codes)
+        return list(query.group_by(day).order_by(day).dicts())
+
+    def videos_per_hashtag_per_day(
+        self,
+        hashtags:list[str] = None,
+        start_date:datetime = None,
+        end_date:datetime = None,
+        region_codes:list[str] = None
+    ):
+        day = fn.date(Video.create_time).coerce(False)
+        query = (HashtagOnVideo
+            .select(
+                day.alias('day'),
+                Hashtag.name.alias('hashtag'),
+                fn.COUNT(Video.id).alias('videos'),
+                fn.SUM(Video.view_cnt).alias('views'),
+            )
+            .join(Hashtag)
+            .switch(HashtagOnVideo)
+            .join(Video)
+        )
+        if hashtags != None:
+            query = query.where(Hashtag.name.in_(hashtags))
+        query = self.filter_videos(query, start_date, end_date, region_codes)
+        return list(query.group_by(day, Hashtag.name).order_by(day, Hashtag.name).dicts())
+
+    def top_creators(
+        self,
+        region_codes:list[str] = None,
+        start_date:datetime = None,
+        end_date:datetime = None,
+        order_by:str = 'views',
+        limit:int = 10
+    ):
+        order = self.top_order(order_by)
+        query = (Video
+            .select(
+                User.username,
+                fn.COUNT(Video.id).alias('videos'),
+                fn.SUM(Video.view_cnt).alias('views'),
+                fn.SUM(Video.like_cnt).alias('likes'),
+                fn.SUM(Video.comment_cnt).alias('comments'),
+                fn.SUM(Video.share_cnt).alias('shares'),
+            )
+            .join(User)
+        )
+        query = self.filter_videos(query, start_date, end_date, region_codes)
+        return list(query.group_by(User.id).order_by(order.desc()).limit(limit).dicts())
+
+    def top_hashtags(
+        self,
+        region_codes:list[str] = None,
+        start_date:datetime = None,
+        end_date:datetime = None,
+        order_by:str = 'videos',
+        limit:int = 20
+    ):
+        order = self.top_order(order_by)
+        query = (HashtagOnVideo
+            .select(
+                Hashtag.name.alias('hashtag'),
+                fn.COUNT(Video.id).alias('videos'),
+                fn.SUM(Video.view_cnt).alias('views'),
+                fn.SUM(Video.like_cnt).alias('likes'),
+            )
+            .join(Hashtag)
+            .switch(HashtagOnVideo)
+            .join(Video)
+        )
+        query = self.filter_videos(query, start_date, end_date, region_codes)
+        return list(query.group_by(Hashtag.id).order_by(order.desc()).limit(limit).dicts())
+
+    def top_music(
+        self,
+        region_codes:list[str] = None,
+        start_date:datetime = None,
+        end_date:datetime = None,
+        order_by:str = 'videos',
+        limit:int = 20
+    ):
+        order = self.top_order(order_by)
+        query = Video.select(
+            Video.music_id,
+            fn.COUNT(Video.id).alias('videos'),
+            fn.SUM(Video.view_cnt).alias('views'),
+            fn.SUM(Video.like_cnt).alias('likes'),
+        ).where(Video.music_id.is_null(False))
+        query = self.filter_videos(query, start_date, end_date, region_codes)
+        return list(query.group_by(Video.music_id).order_by(order.desc()).limit(limit).dicts())
+
+    def comments_per_day(self, video_ids:list[int] = None, start_date:datetime = None, end_date:datetime = None):
+        day = fn.date(Comment.create_time).coerce(False)
+        query = Comment.select(
+            day.alias('day'),
+            fn.COUNT(Comment.id).alias('comments'),
+            fn.SUM(Comment.like_cnt).alias('likes'),
+        )
+        if video_ids != None:
+            query = query.where(Comment.video.in_(
+                Video.select(Video.id).where(Video.item_id.in_(video_ids))
+            ))
+        if start_date != None:
+            query = query.where(Comment.create_time >= start_date)
+        if end_date != None:
+            query = query.where(Comment.create_time < end_date)
+        return list(query.group_by(day).order_by(day).dicts())
@@ -0,0 +1,82 @@
+from .tiktok_research_enums import VideoFields
+import sys
+
+class VideoRecord():
+    # Compact replacement for the video dicts of the API. Subclasses made by video_record_type
+    # hold exactly the requested fields in __slots__, named like the VideoFields members
+    # (record.view_count). get() and [] take the API keys, so a record can be passed
+    # wherever a video dict is expected.
+    __slots__ = ()
+    fields = ()
+    keys_to_slots = {}
+
+    def __init__(self, video:dict):
+        for key, slot in self.keys_to_slots.items():
+            setattr(self, slot, compact_value(key, video.get(key, None)))
+
+    def get(self, key:str, default=None):
+        slot = self.keys_to_slots.get(key, None)
+        if slot == None:
+            return default
+        value = getattr(self, slot)
+        return default if value == None else value
+
+    def __getitem__(self, key:str):
+        if key not in self.keys_to_slots:
+            raise KeyError(key)
+        return getattr(self, self.keys_to_slots[key])
+
+    def __contains__(self, key:str):
+        return key in self.keys_to_slots
+
+    def keys(self):
+        return self.keys_to_slots.keys()
+
+    def to_dict(self):
+        return {key: getattr(self, slot) for key, slot in self.keys_to_slots.items()}
+
+    def __eq__(self, other):
+        return isinstance(other, VideoRecord) and (self.to_dict() == other.to_dict())
+
+    def __repr__(self):
+        return f"VideoRecord({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # the record classes are made at runtime, pickle the projection instead
+        return (restore_video_record, (self.fields, tuple(getattr(self, slot) for slot in self.__slots__)))
+
+# values that repeat across many videos are interned, lists become tuples
+INTERNED_KEYS = {'region_code', 'username'}
+TUPLE_KEYS = {'hashtag_names', 'effect_ids', 'video_mention_list'}
+
+def compact_value(key:str, value):
+    if value == None:
+        return None
+    if (key in INTERNED_KEYS) and isinstance(value, str):
+        return sys.intern(value)
+    if (key in TUPLE_KEYS) and isinstance(value, list):
+        return tuple(sys.intern(v) if isinstance(v, str) else v for v in value)
+    return value
+
+record_types = {}
+
+def video_record_type(fields:list[VideoFields]):
+    # one record class per field projection, the API keys map to the member names of the enum
+    fields = list(dict.fromkeys(fields))
+    key = tuple(f.value for f in fields)
+    record_type = record_types.get(key, None)
+    if record_type == None:
+        record_type = type('VideoRecord', (VideoRecord,), {
+            '__slots__': tuple(f.name for f in fields),
+            'fields': tuple(fields),
+            'keys_to_slots': {f.value: f.name for f in fields},
+        })
+        record_types[key] = record_type
+    return record_type
+
+def restore_video_record(fields:tuple, values:tuple):
+    record_type = video_record_type(fields)
+    record = record_type.__new__(record_type)
+    for field, value in zip(fields, values):
+        setattr(record, field.name, value)
+    return record
@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from .tiktok_research_enums import *
+from .tiktok_research_limiter import RateLimiter
+from .tiktok_research_db import TikTokResearchDb
+from .tiktok_research_merge import merge_databases
+import argparse
+import json
+import os
+
+# Runs the queries of a job spec in worker processes. Every query is cut into shards of
+# shard_days, every shard is scraped into its own sqlite file in shard_dir (resumable through its
+# checkpoints) and the shard files are merged into db_path (see tiktok_research_merge) once all
+# shards are done.
+# Run with: python -m tiktok_research.tiktok_research_runner job.json
+#
+# {
+#     "db_path": "collection.sqlite",
+#     "shard_dir": "collection_shards",
+#     "processes": 4,
+#     "shard_days": 30,
+#     "client_key": "...", "client_secret": "...",
+#     "daily_limits": {"video": 1000},
+#     "queries": [
+#         {"hashtags": ["fyp"], "region_codes": ["DE", "AT"], "start_date": "2024-01-01", "end_date": "2024-07-01",
+#          "fields": ["id", "username", "create_time"], "workers": 2},
+#         {"usernames": ["someone"], "start_date": "2024-01-01", "end_date": "2024-02-01", "incremental": true, "repoll_days": 7}
+#     ]
+# }
+#
+# client_key and client_secret can also be given as TIKTOK_CLIENT_KEY and TIKTOK_CLIENT_SECRET.
+# The daily and window limits are split evenly between the processes.
+
+QUERY_TYPES = ('hashtags', 'usernames', 'music_ids')
+
+def load_job_spec(path:str):
+    with open(path) as f:
+        spec = json.load(f)
+    spec.setdefault('client_key', os.environ.get('TIKTOK_CLIENT_KEY', None))
+    spec.setdefault('client_secret', os.environ.get('TIKTOK_CLIENT_SECRET', None))
+    if (spec['client_key'] == None) or (spec['client_secret'] == None):
+        raise ValueError("the job spec needs client_key and client_secret (or TIKTOK_CLIENT_KEY and TIKTOK_CLIENT_SECRET)")
+    if 'db_path' not in spec:
+        raise ValueError("the job spec needs a db_path")
+    spec.setdefault('shard_dir', os.path.splitext(spec['db_path'])[0] + '_shards')
+    spec.setdefault('files_path', '.')
+    spec.setdefault('processes', os.cpu_count() or 1)
+    spec.setdefault('shard_days', 30)
+    spec.setdefault('queries', [])
+    for i, query in enumerate(spec['queries']):
+        types = [t for t in QUERY_TYPES if t in query]
+        if len(types) != 1:
+            raise ValueError(f"query {i} needs exactly one of {', '.join(QUERY_TYPES)}")
+        if ('start_date' not in query) or ('end_date' not in query):
+            raise ValueError(f"query {i} needs a start_date and an end_date")
+    return spec
+
+def plan_shards(spec:dict):
+    # one shard per query and shard_days date range, the file names stay the same between runs
+    shards = []
+    shard_days = timedelta(days=spec['shard_days'])
+    for i, query in enumerate(spec['queries']):
+        start_date = datetime.fromisoformat(query['start_date'])
+        end_date = datetime.fromisoformat(query['end_date'])
+        while start_date < end_date:
+            shard_end = min(start_date + shard_days, end_date)
+            path = os.path.join(spec['shard_dir'], f"q{i:03d}_{start_date:%Y%m%d}_{shard_end:%Y%m%d}.sqlite")
+            shards.append((i, start_date, shard_end, path))
+            start_date = shard_end
+    return shards
+
+def split_limits(limits:dict, processes:int):
+    if limits == None:
+        return None
+    return {ApiNodes[node]: max(limit // processes, 1) for node, limit in limits.items()}
+
+# the client of a worker process, it moves from shard file to shard file
+worker_client = None
+
+def init_worker(spec:dict):
+    global worker_client
+    processes = spec['processes']
+    limiter = RateLimiter(
+        daily_limits=split_limits(spec.get('daily_limits', None), processes),
+        window_limits=split_limits(spec.get('window_limits', None), processes),
+        window_seconds=spec.get('window_seconds', 60)
+    )
+    kwargs = {}
+    if spec.get('base_address', None) != None:
+        kwargs['base_address'] = spec['base_address']
+    worker_client = TikTokResearchDb(
+        spec['client_key'],
+        spec['client_secret'],
+        ':memory:',
+        files_path=spec['files_path'],
+        limiter=limiter,
+        credentials=spec.get('credentials', None),
+        verbose=spec.get('verbose', False),
+        # the merged db builds its search index when it is opened
+        full_text_search=False,
+        **kwargs
+    )
+
+def run_shard(spec:dict, shard:tuple):
+    i, start_date, end_date, path = shard
+    query = spec['queries'][i]
+    client = worker_client
+    client.db_path = path
+    client.init_db()
+    options = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'workers': query.get('workers', 1),
+        'comments': query.get('comments', False),
+        'download': query.get('download', False),
+        'update': query.get('update', False),
+        'resume': query.get('resume', True),
+        'incremental': query.get('incremental', False),
+        'repoll_days': query.get('repoll_days', 0),
+        'count_only': True,
+    }
+    if 'fields' in query:
+        options['fields'] = [VideoFields(field) for field in query['fields']]
+    if 'hashtags' in query:
+        count = client.scrape_videos_by_hashtag(
+            query['hashtags'],
+            [RegionCodes(code) for code in query.get('region_codes', [])],
+            **options
+        )
+    elif 'usernames' in query:
+        count = client.scrape_videos_by_usernames(query['usernames'], **options)
+    else:
+        count = client.scrape_videos_by_music_ids(query['music_ids'], **options)
+    client.db.close()
+    return path, count
+
+def run_shard_task(task:tuple):
+    return run_shard(*task)
+
+class ScrapeRunner():
+    def __init__(self, spec:dict, log=print):
+        self.spec = spec
+        self.log = log
+
+    def run(self, consolidate:bool = True):
+        # scrapes all shards, returns the number of videos per shard file
+        spec = self.spec
+        os.makedirs(spec['shard_dir'], exist_ok=True)
+        shards = plan_shards(spec)
+        processes = max(min(spec['processes'], len(shards)), 1)
+        self.log(f"{len(shards)} shards on {processes} processes")
+        counts = {}
+        # the limits are split between the processes that actually run
+        with Pool(processes, initializer=init_worker, initargs=(dict(spec, processes=processes),)) as pool:
+            for path, count in pool.imap_unordered(run_shard_task, [(spec, shard) for shard in shards]):
+                counts[path] = count
+                self.log(f"{path}: {count} videos ({len(counts)}/{len(shards)} shards)")
+        if consolidate:
+            self.consolidate([path for _, _, _, path in shards])
+        return counts
+
+    def consolidate(self, shard_paths:list[str] = None):
+        if shard_paths == None:
+            shard_paths = [path for _, _, _, path in plan_shards(self.spec)]
+        return merge_databases(self.spec['db_path'], shard_paths, log=self.log)
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape the queries of a job spec into sharded sqlite files')
+    parser.add_argument('job_spec')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--no-consolidate', action='store_true', help='only scrape the shard files')
+    parser.add_argument('--consolidate-only', action='store_true', help='only consolidate existing shard files')
+    args = parser.parse_args()
+    spec = load_job_spec(args.job_spec)
+    if args.processes != None:
+        spec['processes'] = args.processes
+    runner = ScrapeRunner(spec)
+    if args.consolidate_only:
+        runner.consolidate()
+    else:
+        runner.run(consolidate=not args.no_consolidate)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+from datetime import datetime
+from peewee import SqliteDatabase
+import argparse
+import re
+
+# FTS5 full-text indexes over video descriptions, transcripts and comment texts. The indexes are
+# external content tables: they store only the index and read the texts from video and comment,
+# triggers keep them in sync with every insert, update and delete.
+# Rebuild the indexes of an existing db with: python -m tiktok_research.tiktok_research_search scrape.sqlite
+
+# index -> content table, indexed columns and their bm25 weights
+SEARCH_INDEXES = {
+    'video_fts': {
+        'table': 'video',
+        'columns': ('desc', 'voice_to_text'),
+        'weights': (2.0, 1.0),
+    },
+    'comment_fts': {
+        'table': 'comment',
+        'columns': ('text',),
+        'weights': (1.0,),
+    },
+}
+
+def search_index_sql(index:str):
+    spec = SEARCH_INDEXES[index]
+    table = spec['table']
+    columns = ', '.join(f'"{c}"' for c in spec['columns'])
+    new_values = ', '.join(f'new."{c}"' for c in spec['columns'])
+    old_values = ', '.join(f'old."{c}"' for c in spec['columns'])
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({columns}, "
+        f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"INSERT INTO {index}({index}, rank) VALUES ('rank', 'bm25({', '.join(str(w) for w in spec['weights'])})')",
+        f'CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON "{table}" BEGIN '
+        f'INSERT INTO {index}(rowid, {columns}) VALUES (new.id, {new_values}); END',
+        f'CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON "{table}" BEGIN '
+        f"INSERT INTO {index}({index}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        # count updates of the upserts do not touch the index
+        f'CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE OF {columns} ON "{table}" BEGIN '
+        f"INSERT INTO {index}({index}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f'INSERT INTO {index}(rowid, {columns}) VALUES (new.id, {new_values}); END',
+    ]
+
+def create_search_indexes(database):
+    # creates missing indexes and their triggers, a new index over existing rows is filled at once.
+    # Returns the names of the created indexes.
+    created = []
+    for index in SEARCH_INDEXES:
+        if database.table_exists(index):
+            continue
+        with database.atomic():
+            for sql in search_index_sql(index):
+                database.execute_sql(sql)
+            database.execute_sql(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+        created.append(index)
+    return created
+
+def rebuild_search_indexes(database, optimize:bool = True):
+    # fills the indexes from scratch (e.g. after rows were written with the triggers missing)
+    # and merges their b-trees for faster queries
+    create_search_indexes(database)
+    for index in SEARCH_INDEXES:
+        with database.atomic():
+            database.execute_sql(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+        if optimize:
+            database.execute_sql(f"INSERT INTO {index}({index}) VALUES ('optimize')")
+
+def match_query(query:str, raw:bool = False):
+    # plain keywords become quoted terms that all have to match, raw passes the FTS5 query syntax
+    # (OR, NOT, "phrases", prefix*, NEAR(...)) through
+    if raw:
+        return query
+    terms = re.findall(r'\w+', query)
+    return ' '.join('"' + term + '"' for term in terms)
+
+class TikTokResearchSearch():
+    # Ranked keyword search over the FTS5 indexes. Results are lists of dicts, best match first,
+    # with the bm25 rank (lower is better) and a snippet with the matches between markers.
+    def init_search(self):
+        try:
+            for index in create_search_indexes(self.db):
+                self.log("created search index", index)
+        except Exception as e:
+            if 'fts5' not in str(e):
+                raise
+            self.log("sqlite has no FTS5, full-text search is disabled:", e)
+            self.full_text_search = False
+
+    def rebuild_search_index(self, optimize:bool = True):
+        self.flush()
+        rebuild_search_indexes(self.db, optimize=optimize)
+
+    def search_videos(
+        self,
+        query:str,
+        limit:int = 20,
+        offset:int = 0,
+        raw:bool = False,
+        start_date:datetime = None,
+        end_date:datetime = None,
+        markers:tuple = ('[', ']'),
+        snippet_tokens:int = 12
+    ):
+        match = match_query(query, raw)
+        if match == '':
+            return []
+        sql = (
+            "SELECT v.id, v.item_id, v.create_time, video_fts.rank AS rank, "
+            "snippet(video_fts, -1, ?, ?, '...', ?) AS snippet "
+            "FROM video_fts JOIN video v ON v.id = video_fts.rowid WHERE video_fts MATCH ?"
+        )
+        params = [markers[0], markers[1], snippet_tokens, match]
+        if start_date != None:
+            sql += " AND v.create_time >= ?"
+            params.append(str(start_date))
+        if end_date != None:
+            sql += " AND v.create_time < ?"
+            params.append(str(end_date))
+        sql += " ORDER BY video_fts.rank LIMIT ? OFFSET ?"
+        return self.sql_query(sql, tuple(params + [limit, offset]))
+
+    def search_comments(
+        self,
+        query:str,
+        limit:int = 20,
+        offset:int = 0,
+        raw:bool = False,
+        video_ids:list[int] = None,
+        markers:tuple = ('[', ']'),
+        snippet_tokens:int = 12
+    ):
+        match = match_query(query, raw)
+        if match == '':
+            return []
+        sql = (
+            "SELECT c.id, c.tt_id, v.item_id AS video_id, c.create_time, comment_fts.rank AS rank, "
+            "snippet(comment_fts, 0, ?, ?, '...', ?) AS snippet "
+            "FROM comment_fts JOIN comment c ON c.id = comment_fts.rowid LEFT JOIN video v ON v.id = c.video_id "
+            "WHERE comment_fts MATCH ?"
+        )
+        params = [markers[0], markers[1], snippet_tokens, match]
+        if video_ids != None:
+            sql += f" AND v.item_id IN ({', '.join('?' * len(video_ids))})"
+            params.extend(video_ids)
+        sql += " ORDER BY comment_fts.rank LIMIT ? OFFSET ?"
+        return self.sql_query(sql, tuple(params + [limit, offset]))
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the full-text search indexes of a TikTokResearchDb sqlite file')
+    parser.add_argument('db_path')
+    parser.add_argument('--no-optimize', action='store_true')
+    args = parser.parse_args()
+    database = SqliteDatabase(args.db_path, pragmas={'journal_mode': 'wal'})
+    rebuild_search_indexes(database, optimize=not args.no_optimize)
+    database.close()
+
+if __name__ == '__main__':
+    main()
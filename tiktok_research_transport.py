@@ -0,0 +1,73 @@
+from requests.adapters import HTTPAdapter
+import json
+import requests
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(raw:bytes):
+    if orjson != None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def json_dumps(obj):
+    if orjson != None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+class ApiResponse():
+    # status, headers and the body of an API response, the body is decoded once on creation.
+    # json() returns the decoded body and raises ValueError like requests does if it was no JSON.
+    __slots__ = ('status_code', 'headers', 'content', 'body', 'error')
+
+    def __init__(self, status_code:int, headers, content:bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.body = None
+        self.error = None
+        try:
+            self.body = json_loads(content)
+        except ValueError as e:
+            self.error = e
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        if self.error != None:
+            raise ValueError(f"response is no JSON: {self.error}")
+        return self.body
+
+class RequestsTransport():
+    # Sends the API calls over one requests.Session whose connection pool holds pool_size
+    # connections per host, grown by reserve() to the number of workers in flight.
+    # Bodies are encoded and decoded with orjson when it is installed. Any object with
+    # post_json(), reserve() and a session can be passed to TikTokResearch as transport.
+    def __init__(self, pool_size:int = 10, session:requests.Session = None):
+        self.session = session or requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.lock = threading.Lock()
+        self.pool_size = 0
+        self.reserve(pool_size)
+
+    def reserve(self, connections:int):
+        # remounts the adapters with a larger pool, connections of the old pool in use stay valid
+        with self.lock:
+            if connections <= self.pool_size:
+                return
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=connections)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.pool_size = connections
+
+    def post_json(self, url:str, body, params:dict = None, headers:dict = None, timeout:float = None):
+        res = self.session.post(url, data=json_dumps(body), params=params, headers=headers, timeout=timeout)
+        return ApiResponse(res.status_code, res.headers, res.content)
+
+    def close(self):
+        self.session.close()
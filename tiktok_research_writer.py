@@ -0,0 +1,84 @@
+from .tiktok_research_metrics import Metrics, SIZE_BUCKETS
+import queue
+import threading
+import time
+
+class DbWriter():
+    # Runs db writes in its own thread with its own connection. Writes are queued as
+    # callables and committed together, one transaction per batch of batch_size writes or
+    # per commit_interval seconds. A full queue blocks submit, so a slow disk slows the
+    # fetching down instead of piling up pages in memory.
+    # on_error is called with the exception of a batch that was rolled back.
+    def __init__(self, database, max_queue:int = 100, batch_size:int = 20, commit_interval:float = 1.0, metrics:Metrics = None, on_error=None):
+        self.database = database
+        self.metrics = metrics or Metrics()
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.on_error = on_error
+        self.error = None
+        self.stopped = object()
+        self.flushed = object()
+        self.thread = threading.Thread(target=self.run, name='DbWriter', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, func, *args, **kwargs):
+        self.raise_error()
+        self.queue.put((func, args, kwargs))
+
+    def flush(self):
+        # waits until everything submitted so far is committed
+        self.queue.put(self.flushed)
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self.stopped)
+            self.thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error != None:
+            error, self.error = self.error, None
+            raise error
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.commit_interval
+        while (len(batch) < self.batch_size) and (batch[-1] is not self.stopped) and (batch[-1] is not self.flushed):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        running = True
+        while running:
+            batch = self.next_batch()
+            writes = [item for item in batch if (item is not self.stopped) and (item is not self.flushed)]
+            running = batch[-1] is not self.stopped
+            try:
+                if self.error == None:
+                    with self.metrics.timer('db_commit_seconds'), self.database.atomic():
+                        for func, args, kwargs in writes:
+                            with self.metrics.timer('db_write_seconds', op=getattr(func, '__name__', 'write')):
+                                func(*args, **kwargs)
+                    self.metrics.observe('db_writer_batch_size', len(writes), buckets=SIZE_BUCKETS)
+            except Exception as e:
+                # raised again in the submitting thread
+                self.metrics.inc('db_writer_errors_total')
+                self.error = e
+                if self.on_error != None:
+                    self.on_error(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        self.database.close()